@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, NamedTuple, Optional
+
+import discord
+
+import render
+
+logger = logging.getLogger('discord')
+
+
+class AuditEvent(NamedTuple):
+    locale: discord.Locale
+    message_id: str
+    args: Dict[str, Any]
+
+
+class _GuildQueue:
+    def __init__(self, maxlen: int):
+        self.events: Deque[AuditEvent] = deque(maxlen=maxlen)
+        self.wakeup = asyncio.Event()
+        self.dropped = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class AuditLog:
+    """Per-guild log pipeline that batches events into a few messages.
+
+    Handlers call :meth:`emit` and move on. A worker per guild waits ``window`` seconds after the first
+    event, then packs everything queued into as few log channel messages as the content limit allows.
+    Each guild buffers at most ``max_pending`` events; once it is full the oldest are dropped and the
+    next batch reports how many were lost, so a slow log channel never holds up roster commands.
+    """
+
+    def __init__(self, get_channel: Callable[[int], Awaitable[Optional[discord.abc.Messageable]]],
+                 send: Callable[[discord.abc.Messageable, str], Awaitable[object]],
+                 translate: Callable[..., str], window: float = 2.0, max_pending: int = 500):
+        self._get_channel = get_channel
+        self._send = send
+        self._translate = translate
+        self.window = window
+        self.max_pending = max_pending
+        self._guilds: Dict[int, _GuildQueue] = {}
+        self.dropped_total = 0
+
+    def emit(self, guild_id: int, locale: discord.Locale, message_id: str, **kwargs):
+        queue = self._guilds.get(guild_id)
+        if queue is None:
+            queue = self._guilds[guild_id] = _GuildQueue(self.max_pending)
+
+        if len(queue.events) == self.max_pending:
+            queue.dropped += 1
+            self.dropped_total += 1
+        queue.events.append(AuditEvent(locale, message_id, kwargs))
+        queue.wakeup.set()
+
+        if queue.task is None or queue.task.done():
+            queue.task = asyncio.create_task(self._worker(guild_id, queue))
+
+    async def _worker(self, guild_id: int, queue: _GuildQueue):
+        while True:
+            await queue.wakeup.wait()
+            await asyncio.sleep(self.window)
+            queue.wakeup.clear()
+
+            events = list(queue.events)
+            queue.events.clear()
+            dropped, queue.dropped = queue.dropped, 0
+            if not events:
+                continue
+
+            try:
+                await self._flush(guild_id, events, dropped)
+            except Exception as e:
+                logger.error(f'Error while sending message to log chat: {e}')
+
+    async def _flush(self, guild_id: int, events, dropped: int):
+        channel = await self._get_channel(guild_id)
+        if channel is None:
+            return
+
+        lines = [render.Line(self._translate(event.locale, event.message_id, **event.args)) for event in events]
+        if dropped:
+            lines.append(render.Line(self._translate(events[-1].locale, 'log_entries_dropped', count=dropped)))
+        for content in render.pack(lines):
+            await self._send(channel, content)
@@ -0,0 +1,350 @@
+"""Offline benchmark of display refreshes and roster commands.
+
+Drives bot.py against an in-process stand-in for the Discord client, so no token or network is needed.
+Every channel operation is counted by kind and can be given latency and a share of simulated 429s;
+every SQLite statement is counted through the connection trace callback.
+
+Run from the repository root:
+
+    python benchmarks/bot_bench.py
+    python benchmarks/bot_bench.py --sizes 10 5000 --latency 0.05 --rate-limit 0.02 --paced
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import discord
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import audit  # noqa: E402
+import bot  # noqa: E402
+import database  # noqa: E402
+import i18n  # noqa: E402
+import outbound  # noqa: E402
+import render  # noqa: E402
+import roster  # noqa: E402
+
+GUILD_ID = 1000
+DISPLAY_CHANNEL_ID = 2000
+LOGGING_CHANNEL_ID = 2001
+MEMBERS_PER_GROUP = 50
+MUTATIONS = 10
+
+
+class FakeApi:
+    """Counts channel operations and simulates their latency and rate limits."""
+
+    def __init__(self, latency: float, rate_limit: float, retry_after: float, seed: int = 0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls: collections.Counter = collections.Counter()
+        self._ids = itertools.count()
+
+    def snowflake(self) -> int:
+        return discord.utils.time_snowflake(discord.utils.utcnow()) + next(self._ids) % 4096
+
+    async def call(self, kind: str):
+        self.calls[kind] += 1
+        # discord.py retries a 429 on its own after sleeping, callers only see the delay
+        while self.rate_limit and self.random.random() < self.rate_limit:
+            self.calls['429'] += 1
+            await asyncio.sleep(self.retry_after)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeUser:
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+        self.mention = f'<@{id}>'
+        self.guild_permissions = discord.Permissions.all()
+        self.roles = []
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeAttachment:
+    def __init__(self, filename: str):
+        self.filename = filename
+
+
+class FakeMessage:
+    def __init__(self, id: int, content: Optional[str], author: FakeUser, attachments: List[FakeAttachment]):
+        self.id = id
+        self.content = content or ''
+        self.author = author
+        self.attachments = attachments
+        self.type = discord.MessageType.default
+
+
+class FakePartialMessage:
+    def __init__(self, channel: FakeChannel, id: int):
+        self.channel = channel
+        self.id = id
+
+    async def edit(self, content: Optional[str] = None, attachments: Optional[list] = None):
+        await self.channel.api.call('edit')
+        message = self.channel.messages.get(self.id)
+        if message is not None:
+            if content is not None:
+                message.content = content
+            if attachments is not None:
+                message.attachments = [FakeAttachment(file.filename) for file in attachments]
+        return message
+
+    async def delete(self):
+        await self.channel.api.call('delete')
+        self.channel.messages.pop(self.id, None)
+
+
+class FakeChannel:
+    def __init__(self, id: int, api: FakeApi, author: FakeUser):
+        self.id = id
+        self.api = api
+        self.author = author
+        self.mention = f'<#{id}>'
+        self.messages: Dict[int, FakeMessage] = {}
+
+    async def history(self, oldest_first: bool = False, limit: Optional[int] = None):
+        messages = sorted(self.messages.values(), key=lambda m: m.id, reverse=not oldest_first)[:limit]
+        # History is paged by 100 messages per request
+        for start in range(0, max(len(messages), 1), 100):
+            await self.api.call('history')
+            for message in messages[start:start + 100]:
+                yield message
+
+    async def send(self, content: Optional[str] = None, file: Optional[discord.File] = None):
+        await self.api.call('send')
+        attachments = [FakeAttachment(file.filename)] if file else []
+        message = FakeMessage(self.api.snowflake(), content, self.author, attachments)
+        self.messages[message.id] = message
+        return message
+
+    async def delete_messages(self, messages):
+        await self.api.call('bulk_delete')
+        for message in messages:
+            self.messages.pop(message.id, None)
+
+    def get_partial_message(self, id: int) -> FakePartialMessage:
+        return FakePartialMessage(self, id)
+
+
+class FakeClient:
+    def __init__(self, api: FakeApi):
+        self.user = FakeUser(1, 'MemberBot')
+        self.channels: Dict[int, FakeChannel] = {}
+        self.api = api
+
+    def add_channel(self, id: int) -> FakeChannel:
+        channel = self.channels[id] = FakeChannel(id, self.api, self.user)
+        return channel
+
+    def get_channel(self, id: int) -> Optional[FakeChannel]:
+        return self.channels.get(id)
+
+
+class FakeResponse:
+    def __init__(self, api: FakeApi):
+        self.api = api
+
+    async def send_message(self, content: Optional[str] = None, ephemeral: bool = False):
+        await self.api.call('interaction_response')
+
+
+class FakeGuild:
+    def __init__(self, id: int):
+        self.id = id
+
+    def get_role(self, id: int):
+        return None
+
+
+class FakeInteraction:
+    def __init__(self, api: FakeApi, user: FakeUser):
+        self.guild = FakeGuild(GUILD_ID)
+        self.user = user
+        self.locale = discord.Locale.american_english
+        self.response = FakeResponse(api)
+
+
+class RefreshCounter:
+    """Stands in for the refresh scheduler so each phase renders exactly once, when the harness asks."""
+
+    def __init__(self):
+        self.marks = 0
+
+    def mark_dirty(self, guild_id: int, force: bool = False):
+        self.marks += 1
+
+
+class Harness:
+    def __init__(self, path: str, args: argparse.Namespace):
+        self.api = FakeApi(args.latency, args.rate_limit, args.retry_after, seed=args.seed)
+        self.client = FakeClient(self.api)
+        self.display = self.client.add_channel(DISPLAY_CHANNEL_ID)
+        self.client.add_channel(LOGGING_CHANNEL_ID)
+        self.admin = FakeUser(10, 'officer')
+        self.queries = 0
+        self.db = database.Database(path)
+        self.paced = args.paced
+        self.log_window = args.log_window
+        self.layout = args.layout
+
+    def _trace(self, statement: str):
+        self.queries += 1
+
+    async def setup(self):
+        await self.db.open()
+        await self.db.transaction(bot.migrations.migrate)
+        await self.db._call(lambda: self.db._conn.set_trace_callback(self._trace))
+
+        # Rebind the module globals every handler looks up at call time
+        bot.client = self.client
+        bot.db = self.db
+        bot.rosters = roster.RosterStore(self.db)
+        bot.display_map = render.DisplayMap(self.db)
+        if self.paced:
+            bot.rest = outbound.Outbound(rate=5, per=5.0, global_rate=40, hold=1.0)
+        else:
+            bot.rest = outbound.Outbound(rate=10 ** 6, per=1.0, global_rate=10 ** 6, hold=0.0)
+        bot.audit_log = audit.AuditLog(
+            get_channel=bot.logging_chat,
+            send=lambda channel, content: bot.rest.send(channel, priority=outbound.PRIORITY_LOG, content=content),
+            translate=i18n.text, window=self.log_window)
+        bot.refresher = RefreshCounter()
+        bot.DISPLAY_LAYOUT = self.layout
+        await bot.rosters.set_channels(GUILD_ID, DISPLAY_CHANNEL_ID, LOGGING_CHANNEL_ID)
+
+    async def close(self):
+        for queue in bot.audit_log._guilds.values():
+            if queue.task is not None:
+                queue.task.cancel()
+        await self.db.close()
+
+    async def seed(self, size: int) -> List[int]:
+        group_ids = []
+        for index in range(max(1, size // MEMBERS_PER_GROUP)):
+            group = await bot.rosters.create_group(GUILD_ID, f'Squad {index:04}', index % 7)
+            group_ids.append(group.id)
+
+        rows = [(GUILD_ID, 100000 + i, f'member{i}', f'steam{i}', f'https://steamcommunity.com/id/member{i}',
+                 group_ids[i % len(group_ids)]) for i in range(size)]
+        await self.db.transaction(lambda cursor: cursor.executemany('''
+            INSERT INTO users (guild_id, discord_id, discord_name, steam_name, steam_profile, group_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows))
+        bot.rosters.invalidate(GUILD_ID)
+        return group_ids
+
+    async def drain(self):
+        # Let queued audit batches go out so their sends land in the phase that caused them
+        while any(queue.wakeup.is_set() for queue in bot.audit_log._guilds.values()) or bot.rest._routes:
+            await asyncio.sleep(0.001)
+
+    async def phase(self, name: str, coro_fn) -> dict:
+        self.api.calls.clear()
+        self.queries = 0
+        marks = bot.refresher.marks
+        start = time.perf_counter()
+        await coro_fn()
+        await self.drain()
+        elapsed = time.perf_counter() - start
+        return {
+            'phase': name,
+            'wall_ms': elapsed * 1000,
+            'calls': dict(self.api.calls),
+            'queries': self.queries,
+            'marks': bot.refresher.marks - marks,
+            'messages': len(self.display.messages),
+        }
+
+    def interaction(self) -> FakeInteraction:
+        return FakeInteraction(self.api, self.admin)
+
+    async def mutations(self, group_ids: List[int], size: int):
+        users = [FakeUser(900000 + i, f'recruit{i}') for i in range(MUTATIONS)]
+        for user in users:
+            await bot.add_user.callback(self.interaction(), group_ids[0], user, user.name,
+                                        f'https://steamcommunity.com/id/{user.name}')
+        for user in users:
+            await bot.move_user.callback(self.interaction(), user, group_ids[-1])
+        for user in users:
+            await bot.remove_user.callback(self.interaction(), user)
+        await bot.rename_group.callback(self.interaction(), group_ids[0], 'Squad renamed', 0)
+        await bot.create_group.callback(self.interaction(), 'Reserve', 99)
+        await bot.update_display_channel(GUILD_ID)
+
+    async def single_add(self, group_id: int):
+        user = FakeUser(990000, 'latecomer')
+        await bot.add_user.callback(self.interaction(), group_id, user, user.name, 'latecomer')
+        await bot.update_display_channel(GUILD_ID)
+
+
+async def run_size(size: int, args: argparse.Namespace) -> List[dict]:
+    with tempfile.TemporaryDirectory() as directory:
+        harness = Harness(os.path.join(directory, 'bench.db'), args)
+        await harness.setup()
+        try:
+            group_ids = await harness.seed(size)
+            results = [
+                await harness.phase('cold render', lambda: bot.update_display_channel(GUILD_ID)),
+                await harness.phase('unchanged render', lambda: bot.update_display_channel(GUILD_ID)),
+                await harness.phase(f'{MUTATIONS * 3 + 2} commands + render',
+                                    lambda: harness.mutations(group_ids, size)),
+                await harness.phase('1 add + render', lambda: harness.single_add(group_ids[len(group_ids) // 2])),
+                await harness.phase('forced render', lambda: bot.update_display_channel(GUILD_ID, force=True)),
+            ]
+        finally:
+            await harness.close()
+    return results
+
+
+def report(size: int, results: List[dict]):
+    print(f'\n{size} members')
+    print(f'  {"phase":<22} {"wall ms":>10} {"sql":>6} {"msgs":>5}  api calls')
+    for result in results:
+        calls = ', '.join(f'{kind}={count}' for kind, count in sorted(result['calls'].items())) or '-'
+        print(f'  {result["phase"]:<22} {result["wall_ms"]:>10.1f} {result["queries"]:>6} '
+              f'{result["messages"]:>5}  {calls}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every API call')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='share of API calls answered with a 429')
+    parser.add_argument('--retry-after', type=float, default=0.05, help='seconds a simulated 429 waits')
+    parser.add_argument('--log-window', type=float, default=0.05, help='seconds the audit log batches entries')
+    parser.add_argument('--layout', choices=['groups', 'compact'], default=bot.DISPLAY_LAYOUT)
+    parser.add_argument('--paced', action='store_true', help='use the production outbound rate limits')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        report(size, asyncio.run(run_size(size, args)))
+
+
+if __name__ == '__main__':
+    main()
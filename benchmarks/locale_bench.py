@@ -0,0 +1,134 @@
+"""Compare the legacy locale_text replace chain with the i18n catalog.
+
+Run from the repository root: python benchmarks/locale_bench.py
+"""
+import os
+import sys
+import timeit
+
+import discord
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import i18n  # noqa: E402
+
+GROUPS = 300
+LOG_LINES = 500
+REPEAT = 20
+
+
+# Copied verbatim from bot.py before the catalog replaced it
+def locale_text(locale: discord.Locale, message: str) -> str:
+    if locale is discord.Locale.russian:
+        if 'Sent the database file in private messages.' in message:
+            message = message.replace('Sent the database file in private messages.', 'Отправил файл базы данных в личные сообщения.')
+        if 'Commands syncronized' in message:
+            message = message.replace('Commands syncronized', 'Команды синхронизированы')
+        if 'priority' in message:
+            message = message.replace('priority', 'приоритет')
+        if 'Existing groups:' in message:
+            message = message.replace('Existing groups:', 'Список групп:')
+        if 'No groups found.' in message:
+            message = message.replace('No groups found.', 'Группы не найдены.')
+        if 'Group with id' in message:
+            message = message.replace('Group with id', 'Группа с идентификатором')
+        if 'does not exist!' in message:
+            message = message.replace('does not exist!', 'не существует!')
+        if 'already exists!' in message:
+            message = message.replace('already exists!', 'уже существует!')
+        if 'Group list updated!' in message:
+            message.replace('Group list updated!', 'Список участников обновлён!')
+        if 'User' in message:
+            message = message.replace('User', 'Пользователь')
+        if 'Group' in message:
+            message = message.replace('Group', 'Группа')
+        if 'moved to group' in message:
+            message = message.replace('moved to group', 'перемещён в группу')
+        if 'removed from all groups!' in message:
+            message = message.replace('removed from all groups!', 'удалён из всех групп!')
+        if 'added to group' in message:
+            message = message.replace('added to group', 'добавлен в группу')
+        if 'renamed to' in message:
+            message = message.replace('renamed to', 'переименована в')
+        if 'deleted' in message:
+            message = message.replace('deleted', 'удалена')
+        if 'created' in message:
+            message = message.replace('created', 'создана')
+        if 'Display channel set to' in message:
+            message = message.replace('Display channel set to', 'Канал отображения установлен в')
+        if "now have access to bot commands" in message:
+            message = message.replace('now have access to bot commands', 'теперь имеет доступ к командам бота')
+        if 'You do not have permission to use this command.' in message:
+            message = message.replace('You do not have permission to use this command.', 'У вас нет прав на использование данной команды.')
+        if 'Roles have access to bot commands:' in message:
+            message = message.replace('Roles have access to bot commands:', 'Роли, имеющие доступ к командам бота')
+        if 'rights to use bot commands have been removed':
+            message = message.replace('rights to use bot commands have been removed', 'права на использование команд бота были отозваны')
+        if 'did not have access to bot commands':
+            message = message.replace('did not have access to bot commands', 'не имел прав на использование команд бота')
+        if 'already had access to commands':
+            message = message.replace('already had access to commands', 'уже имеет доступ к командам бота')
+        if 'There is no roles have access to bot commands in this server':
+            message = message.replace('There is no roles have access to bot commands in this server', 'На этом сервере нет ролей, которым был бы разрешён доступ к командам бота')
+        if 'set display chat to' in message:
+            message = message.replace('set display chat to', 'установил канал для отображения списка в')
+        if 'Logging chat now in' in message:
+            message = message.replace('Logging chat now in', 'Канал для логов теперь в')
+        if 'created a group' in message:
+            message = message.replace('created a group', 'создал группу')
+        if 'with priority' in message:
+            message = message.replace('with priority', 'с приоритетом')
+        if 'deleted group' in message:
+            message = message.replace('deleted group', 'удалил группу')
+        if 'renamed group' in message:
+            message = message.replace('renamed group', 'переименовал группу')
+        if 'to group' in message:
+            message = message.replace('to group', 'в группу')
+        if 'I cannot send messages to you. Please check your privacy settings.' in message:
+            message = message.replace('I cannot send messages to you. Please check your privacy settings.', 'Не могу отправить Вам приватное сообщение. Проверьте настройки приватности.')
+        if 'to' in message:
+            message = message.replace('to', 'в')
+        if 'added user' in message:
+            message = message.replace('added user', 'добавил пользователя')
+        if 'removed user' in message:
+            message = message.replace('removed user', 'удалил пользователя')
+        if 'from all groups' in message:
+            message = message.replace('from all groups', 'из всех групп')
+        if 'moved user' in message:
+            message = message.replace('moved user', 'переместил пользователя')
+        if 'updated group list channel' in message:
+            message = message.replace('updated group list channel', 'обновил канал с группами')
+        if 'set access to' in message:
+            message = message.replace('set access to', 'добавил доступ к боту для')
+        if 'removed access from' in message:
+            message = message.replace('removed access from', 'удалил доступ к боту у')
+    return message
+
+
+def legacy_workload(locale):
+    groups = "\n".join([locale_text(locale=locale, message=f'**{i}.** `Group {i}` : *priority = `{i % 10}`*')
+                        for i in range(GROUPS)])
+    locale_text(locale=locale, message=f"Existing groups:\n{groups}")
+    for i in range(LOG_LINES):
+        locale_text(locale=locale, message=f'<@{i}> added user <@{i + 1}> to group `Group {i % GROUPS}`')
+
+
+def catalog_workload(locale):
+    groups = "\n".join([i18n.text(locale, 'group_list_entry', id=i, name=f'Group {i}', priority=i % 10)
+                        for i in range(GROUPS)])
+    i18n.text(locale, 'group_list', groups=groups)
+    for i in range(LOG_LINES):
+        i18n.text(locale, 'log_user_added', actor=f'<@{i}>', user=f'<@{i + 1}>', group=f'Group {i % GROUPS}')
+
+
+def main():
+    print(f'{GROUPS} list_groups entries + {LOG_LINES} log lines, best of {REPEAT}')
+    for locale in (discord.Locale.american_english, discord.Locale.russian):
+        legacy = min(timeit.repeat(lambda: legacy_workload(locale), number=1, repeat=REPEAT))
+        catalog = min(timeit.repeat(lambda: catalog_workload(locale), number=1, repeat=REPEAT))
+        print(f'{locale.value:>6}: legacy {legacy * 1000:8.3f} ms  catalog {catalog * 1000:8.3f} ms  '
+              f'x{legacy / catalog:.1f}')
+
+
+if __name__ == '__main__':
+    main()
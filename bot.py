@@ -1,233 +1,225 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
-import re
-import sqlite3
-import traceback
-from typing import Union
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional, Union
 
+import aiohttp
 import discord
 from discord import app_commands
 from discord.app_commands import commands
-from discord.utils import get
 
+import audit
+import bulk
+import database
+import display
 import env
+import i18n
+import importer
+import jobs
+import members
+import metrics
+import migrations
+import outbound
+import refresh
+import render
+import roster
+import snapshot
+
+
+class CommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras['started'] = time.perf_counter()
+        # Users picked in command options come fully resolved with the interaction
+        for _, value in interaction.namespace:
+            if isinstance(value, discord.abc.User):
+                resolver.remember(value)
+        return True
+
+
+def shard_range(text: str) -> List[int]:
+    """Parses shard ids like ``0-3,6``."""
+    shard_ids = []
+    for part in text.split(','):
+        first, _, last = part.strip().partition('-')
+        shard_ids.extend(range(int(first), int(last or first) + 1))
+    return shard_ids
+
+
+if os.environ.get('BOT_SHARD_IDS'):
+    SHARD_IDS = shard_range(os.environ['BOT_SHARD_IDS'])
+else:
+    SHARD_IDS = getattr(env, 'shard_ids', None)
+    SHARD_IDS = list(SHARD_IDS) if SHARD_IDS is not None else None
+SHARD_COUNT = int(os.environ.get('BOT_SHARD_COUNT') or 0) or getattr(env, 'shard_count', None)
+if SHARD_IDS is not None and not SHARD_COUNT:
+    raise ValueError('shard_ids (BOT_SHARD_IDS) also needs shard_count (BOT_SHARD_COUNT), the total number of shards')
+if SHARD_IDS is not None and any(not 0 <= shard_id < SHARD_COUNT for shard_id in SHARD_IDS):
+    raise ValueError(f'shard_ids {SHARD_IDS} have to be between 0 and shard_count - 1 ({SHARD_COUNT - 1})')
 
 intents = discord.Intents.default()
-client = discord.Client(intents=intents)
-tree = app_commands.CommandTree(client)
+# Member join, update and leave events keep stored names and presence current; needs the Server Members Intent
+intents.members = True
+# Only roster members are looked up, by id, when a guild becomes available instead of downloading every member
+client = discord.AutoShardedClient(intents=intents, chunk_guilds_at_startup=False, shard_ids=SHARD_IDS,
+                                   shard_count=SHARD_COUNT)
+tree = CommandTree(client)
+resolver = members.MemberResolver(client, members.UserCache(maxsize=2048, ttl=900.0))
 
 DATABASE_PATH = 'bot_data.db'
+db = database.Database(DATABASE_PATH)
+rosters = roster.RosterStore(db)
+display_map = render.DisplayMap(db)
+# The global rate limit is per bot, the render workers and a process running part of the shards get their share of it
+GLOBAL_RATE = getattr(env, 'global_rate', 40)
+if getattr(env, 'render_worker', False):
+    GLOBAL_RATE -= getattr(env, 'render_worker_rate', 20)
+if SHARD_IDS is not None:
+    GLOBAL_RATE = GLOBAL_RATE * len(SHARD_IDS) // SHARD_COUNT
+GLOBAL_RATE = max(1, GLOBAL_RATE)
+rest = outbound.Outbound(rate=5, per=5.0, global_rate=GLOBAL_RATE, hold=1.0)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('discord')
+logging.getLogger('discord.http').addHandler(metrics.RateLimitHandler())
+
+
+def observe_command(interaction: discord.Interaction, outcome: str):
+    started = interaction.extras.get('started')
+    if started is not None and interaction.command is not None:
+        metrics.registry.observe('command_seconds', time.perf_counter() - started,
+                                 command=interaction.command.qualified_name, outcome=outcome)
 
 
 # Initialize database
-def init_db():
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS groups (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            priority INTEGER NOT NULL
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            discord_id INTEGER NOT NULL,
-            discord_name TEXT NOT NULL,
-            steam_name TEXT NOT NULL,
-            steam_profile TEXT NOT NULL,
-            group_id INTEGER,
-            FOREIGN KEY(group_id) REFERENCES groups(id)
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            guild_id INTEGER PRIMARY KEY,
-            display_channel_id INTEGER,
-            logging_channel_id INTEGER
-        )
-    ''')
-    conn.commit()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS permissions (
-                      guild_id INTEGER,
-                      role_id INTEGER)''')
-    conn.commit()
-    conn.close()
+async def init_db():
+    await db.open()
+    await db.transaction(migrations.migrate)
+
+
+async def command_tree_hash() -> str:
+    # The same payload tree.sync uploads, so any change Discord would see changes the hash
+    translator = tree.translator
+    payload = [await command.get_translated_payload(translator) if translator else command.to_dict()
+               for command in tree.get_commands()]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+async def sync_commands(force: bool = False):
+    await tree.set_translator(i18n.Translator())
+    key = f'command_tree_hash:{client.application_id}'
+    digest = await command_tree_hash()
+    row = await db.fetchone('SELECT value FROM bot_state WHERE key = ?', (key,))
+    if not force and row is not None and row[0] == digest:
+        logger.info('Command tree unchanged, skipping sync')
+        return
 
+    await tree.sync()
+    await db.execute('INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)', (key, digest))
+    logger.info('Command tree synced')
 
-async def log(msg: str, interaction: discord.Interaction):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute(f'SELECT logging_channel_id FROM settings WHERE guild_id = {interaction.guild.id}')
 
-    logger.info(msg)
+async def logging_chat(guild_id: int):
+    logging_chat_id = (await rosters.get(guild_id)).logging_channel_id
+    return client.get_channel(logging_chat_id) if logging_chat_id is not None else None
 
-    logging_chat_id = cursor.fetchone()[0]
-    if logging_chat_id is None:
-        conn.close()
-        return
 
-    conn.close()
+audit_log = audit.AuditLog(get_channel=logging_chat,
+                           send=lambda channel, content: rest.send(channel, priority=outbound.PRIORITY_LOG, content=content),
+                           translate=i18n.text,
+                           window=2.0, max_pending=500)
 
-    try:
-        logging_chat = client.get_channel(logging_chat_id)
 
-        await logging_chat.send(locale_text(locale=interaction.locale, message=msg))
-    except Exception as e:
-        logger.error(f'Error while sending message to log chat: {e}')
+def log(interaction: discord.Interaction, message_id: str, **kwargs):
+    logger.info(i18n.text(None, message_id, **kwargs))
+    audit_log.emit(interaction.guild.id, interaction.locale, message_id, **kwargs)
 
 
 def check_permissions():
     async def predicate(interaction: discord.Interaction):
         if interaction.user.guild_permissions.administrator:
             return True
-        guild_id = interaction.guild.id
-        user_roles = [role.id for role in interaction.user.roles]
-
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
+        allowed_roles = (await rosters.get(interaction.guild.id)).allowed_roles
+        return not allowed_roles.isdisjoint(role.id for role in interaction.user.roles)
+    return commands.check(predicate)
 
-        cursor.execute('SELECT role_id FROM permissions WHERE guild_id = ?', (guild_id,))
-        allowed_roles = [row[0] for row in cursor.fetchall()]
 
-        return any(role in allowed_roles for role in user_roles)
-    return commands.check(predicate)
+# 'groups' gives every group its own messages and numbering, so a change only rewrites that group;
+# 'compact' packs the whole roster as tightly as possible with one running number
+DISPLAY_LAYOUT = getattr(env, 'display_layout', 'groups')
 
 
-async def update_display_channel(interaction: discord.Interaction):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute(f'SELECT display_channel_id FROM settings WHERE guild_id = {interaction.guild.id}')
-    display_channel_id = cursor.fetchone()[0]
-    if display_channel_id is None:
-        conn.close()
+async def update_display_channel(guild_id: int, force: bool = False):
+    guild_roster = await rosters.get(guild_id)
+    if guild_roster.display_channel_id is None:
         return
 
-    channel = client.get_channel(display_channel_id)
+    channel = client.get_channel(guild_roster.display_channel_id)
     if channel is None:
-        conn.close()
         return
 
-    cursor.execute('''
-        SELECT g.name, u.discord_id, u.discord_name, u.steam_name, u.steam_profile
-        FROM groups g
-        LEFT JOIN users u ON g.id = u.group_id
-        ORDER BY g.id, u.id
-    ''')
-    groups = cursor.fetchall()
-
-    current_group = None
-    user_count = 1
-    msg_number = -1
-
-    def num():
-        nonlocal msg_number
-        msg_number += 1
-        return msg_number
-
-    async def send(msg_num: int, context: str, file=None):
-        msgs = [msg async for msg in channel.history(oldest_first=True, limit=500)]
-        while True:
-            if msg_num <= len(msgs) - 1 and msgs[msg_num].type != discord.MessageType.default:
-                msg_num = num()
-                continue
-
-            if msg_num > len(msgs) - 1 or len(msgs) == 0:
-                await channel.send(content=context, file=file)
-                return
-            else:
-                if msgs[msg_num].author != client.user:
-                    msg = msgs[msg_num]
-                    await msg.delete()
-                    msg_num = num()
-                    continue
-                else:
-                    msg = msgs[msg_num]
-                    if file:
-                        await msg.edit(content=context, attachments=[file])
-                    else:
-                        if msg.content != context:
-                            await msg.edit(content=context, attachments=[])
-                    return
-
-    async def remove_unnecessary(msg_num: int):
-        while True:
-            msgs = [msg async for msg in channel.history(oldest_first=True, limit=500)]
-
-            if msg_num <= len(msgs) - 1 and msgs[msg_num].type != discord.MessageType.default:
-                return await remove_unnecessary(msg_num=num())
-
-            count = len(msgs)
-            if msg_num > count - 1:
-                return
-            else:
-                msg = msgs[msg_num]
-                await msg.delete()
+    await render.render(guild_id, channel, client.user, display.blocks(guild_roster, DISPLAY_LAYOUT), display_map, rest,
+                        force=force)
+
+
+def shard_of(guild_id: int) -> int:
+    return (guild_id >> 22) % (client.shard_count or 1)
 
-    try:
-        picture = discord.File(fp="logo.png")
-        await send(msg_num=num(),
-                   context="...........................................................................................................................................",
-                   file=picture)
-        await send(msg_num=num(),
-                   context="...........................................................................................................................................")
-    except Exception as e:
-        traceback.print_exc()
-
-    await send(msg_num=num(), context="""⫘⫘⫘⫘⫘⫘⫘ **A S T R A   M I L I T A R U M** ⫘⫘⫘⫘⫘⫘⫘
-
-▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒
-** **""")
-    for group in groups:
-        group_name, discord_id, discord_name, steam_name, steam_profile = group
-        if group_name != current_group:
-            if current_group is not None:
-                await send(msg_num=num(), context="""** **
-▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒
-** **""")
-            await send(msg_num=num(), context=f"⫘⫘⫘⫘⫘⫘⫘⫘⫘ `{group_name}` ⫘⫘⫘⫘⫘⫘⫘⫘⫘")
-            current_group = group_name
-
-        if discord_id is not None:
-            discord_user = await client.fetch_user(discord_id)
-            steam = f'<{steam_profile}>' if re.search("(https?://[\w.-]+)", steam_profile) else steam_profile
-            content = f"{user_count}. {discord_user.mention} - {steam_name} - {steam}"
-            await send(msg_num=num(), context=content)
-            user_count += 1
-
-    if current_group is not None:
-        await send(msg_num=num(), context="""** **
-▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒
-** **""")
-    await remove_unnecessary(num())
-    conn.close()
+
+if getattr(env, 'render_worker', False):
+    # worker.py processes render the display channels, this process only writes data and queues the jobs
+    refresher = jobs.RenderQueue(db, quiet_window=getattr(env, 'refresh_quiet_window', 2.0),
+                                 max_delay=getattr(env, 'refresh_max_delay', 10.0))
+else:
+    refresher = refresh.RefreshScheduler(update_display_channel,
+                                         quiet_window=getattr(env, 'refresh_quiet_window', 2.0),
+                                         max_delay=getattr(env, 'refresh_max_delay', 10.0),
+                                         shard_of=shard_of, workers=getattr(env, 'render_workers', 2))
 
 
 @tree.command(
     name="load_data",
     description="Load data file",
 )
+@app_commands.describe(format='SQLite database of this server, or the roster as JSON or CSV')
+@app_commands.choices(format=[
+    app_commands.Choice(name='SQLite', value='sqlite'),
+    app_commands.Choice(name='JSON', value='json'),
+    app_commands.Choice(name='CSV', value='csv'),
+])
 @discord.app_commands.checks.has_permissions(administrator=True)
-async def load_data(interaction: discord.Interaction):
-
-
-    try:
-        db = discord.File(fp="bot_data.db")
-        await interaction.user.send(file=db)
-        await interaction.response.send_message(
-            locale_text(locale=interaction.locale, message=f"Sent the database file in private messages."),
-            ephemeral=True)
-    except discord.Forbidden:
-        await interaction.response.send_message(
-            locale_text(locale=interaction.locale,
-                        message="I cannot send messages to you. Please check your privacy settings."),
-            ephemeral=True
-        )
+async def load_data(interaction: discord.Interaction, format: str = 'sqlite'):
+    await interaction.response.defer(ephemeral=True)
+    # Files go out by direct message, which has the default attachment limit whatever the server's boost level
+    limit = discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES
+
+    with tempfile.TemporaryDirectory() as directory:
+        if format == 'sqlite':
+            path = await snapshot.database(DATABASE_PATH, interaction.guild.id, directory)
+        else:
+            path = await snapshot.roster_export(await rosters.get(interaction.guild.id), format, directory)
+        if format == 'sqlite' or os.path.getsize(path) > limit:
+            path = await snapshot.compress(path)
+
+        size = os.path.getsize(path)
+        if size > limit:
+            await interaction.followup.send(
+                i18n.text(interaction.locale, 'export_too_large', size=f'{size / 2 ** 20:.1f}', limit=limit // 2 ** 20),
+                ephemeral=True)
+            return
+
+        try:
+            await interaction.user.send(file=discord.File(fp=path))
+        except discord.Forbidden:
+            await interaction.followup.send(i18n.text(interaction.locale, 'dm_forbidden'), ephemeral=True)
+            return
+
+    await interaction.followup.send(
+        i18n.text(interaction.locale, 'database_sent' if format == 'sqlite' else 'export_sent'), ephemeral=True)
 
 
 @tree.command(
@@ -236,27 +228,17 @@ async def load_data(interaction: discord.Interaction):
 )
 @discord.app_commands.checks.has_permissions(administrator=True)
 async def set_display_channel(interaction: discord.Interaction, display_channel: Union[discord.TextChannel, discord.Thread], logging_chat: discord.TextChannel = None):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute(f'''
-    INSERT INTO settings (display_channel_id, guild_id, logging_channel_id)
-    VALUES ({display_channel.id}, {interaction.guild.id}, {logging_chat.id if logging_chat else 'NULL'})
-    ON CONFLICT(guild_id) DO UPDATE SET
-        display_channel_id = excluded.display_channel_id,
-        logging_channel_id = excluded.logging_channel_id
-    ''')
-    conn.commit()
-
-    msg = f"<@{interaction.user.id}> set display chat to <#{display_channel.id}>."
-    if logging_chat:
-        msg += f" Logging chat now in <#{logging_chat.id}>"
-    await log(msg=msg, interaction=interaction)
+    await rosters.set_channels(interaction.guild.id, display_channel.id, logging_chat.id if logging_chat else None)
 
-    conn.close()
+    if logging_chat:
+        log(interaction, 'log_display_and_logging_channel_set', actor=interaction.user.mention,
+            channel=display_channel.mention, logging_channel=logging_chat.mention)
+    else:
+        log(interaction, 'log_display_channel_set', actor=interaction.user.mention, channel=display_channel.mention)
 
     await interaction.response.send_message(
-        locale_text(locale=interaction.locale, message=f"Display channel set to {display_channel.mention}"), ephemeral=True)
-    await update_display_channel(interaction=interaction)
+        i18n.text(interaction.locale, 'display_channel_set', channel=display_channel.mention), ephemeral=True)
+    refresher.mark_dirty(interaction.guild.id)
 
 
 @tree.command(
@@ -265,18 +247,18 @@ async def set_display_channel(interaction: discord.Interaction, display_channel:
 )
 @check_permissions()
 async def create_group(interaction: discord.Interaction, group_name: str, priority: int):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR IGNORE INTO groups (name) VALUES (?, ?)', (group_name, priority))
-    conn.commit()
+    group = await rosters.create_group(interaction.guild.id, group_name, priority)
 
-    await log(interaction=interaction, msg=f'<@{interaction.user.id}> created a group `{group_name}` with priority `{priority}`')
+    if group is None:
+        await interaction.response.send_message(
+            i18n.text(interaction.locale, 'group_exists', group=group_name), ephemeral=True)
+        return
 
-    conn.close()
+    log(interaction, 'log_group_created', actor=interaction.user.mention, group=group_name, priority=priority)
 
     await interaction.response.send_message(
-        locale_text(locale=interaction.locale, message=f"Group `{group_name}` created!"), ephemeral=True)
-    await update_display_channel(interaction=interaction)
+        i18n.text(interaction.locale, 'group_created', group=group_name), ephemeral=True)
+    refresher.mark_dirty(interaction.guild.id)
 
 
 @tree.command(
@@ -285,22 +267,20 @@ async def create_group(interaction: discord.Interaction, group_name: str, priori
 )
 @check_permissions()
 async def delete_group(interaction: discord.Interaction, group_id: int):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+    group = await rosters.delete_group(interaction.guild.id, group_id)
 
-    cursor.execute(f'SELECT name FROM groups WHERE id = {group_id}')
-    group_name = cursor.fetchone()[0]
-
-    cursor.execute(f'DELETE FROM groups WHERE id = {group_id}', )
-    cursor.execute(f'DELETE FROM users WHERE group_id = {group_id}')
-    conn.commit()
-    conn.close()
+    if group is None:
+        await interaction.response.send_message(
+            i18n.text(interaction.locale, 'group_not_found', group_id=group_id),
+            ephemeral=True)
+        return
+    group_name = group.name
 
-    await log(interaction=interaction, msg=f'<@{interaction.user.id}> deleted group `{group_name}`')
+    log(interaction, 'log_group_deleted', actor=interaction.user.mention, group=group_name)
 
     await interaction.response.send_message(
-        locale_text(locale=interaction.locale, message=f"Group `{group_name}` deleted!"), ephemeral=True)
-    await update_display_channel(interaction=interaction)
+        i18n.text(interaction.locale, 'group_deleted', group=group_name), ephemeral=True)
+    refresher.mark_dirty(interaction.guild.id)
 
 
 @tree.command(
@@ -310,22 +290,25 @@ async def delete_group(interaction: discord.Interaction, group_id: int):
 @app_commands.describe(group_id="Name of the group")
 @check_permissions()
 async def rename_group(interaction: discord.Interaction, group_id: int, new_name: str, priority: int):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute(f'SELECT name FROM groups WHERE id = {group_id}')
-    group_name = cursor.fetchone()[0]
+    group_name = await rosters.rename_group(interaction.guild.id, group_id, new_name, priority)
 
-    cursor.execute(f'UPDATE groups SET name = "{new_name}", priority = {priority} WHERE id = {group_id}')
-    conn.commit()
-    conn.close()
+    if group_name is None:
+        await interaction.response.send_message(
+            i18n.text(interaction.locale, 'group_not_found', group_id=group_id),
+            ephemeral=True)
+        return
+    if group_name is roster.NAME_TAKEN:
+        await interaction.response.send_message(
+            i18n.text(interaction.locale, 'group_exists', group=new_name), ephemeral=True)
+        return
 
-    await log(interaction=interaction, msg=f'<@{interaction.user.id}> renamed group `{group_name}` to `{new_name}` with priority `{priority}`')
+    log(interaction, 'log_group_renamed', actor=interaction.user.mention, group=group_name, new_name=new_name,
+        priority=priority)
 
     await interaction.response.send_message(
-        locale_text(locale=interaction.locale, message=f"Group `{group_name}` renamed to `{new_name}`!"),
+        i18n.text(interaction.locale, 'group_renamed', group=group_name, new_name=new_name),
         ephemeral=True)
-    await update_display_channel(interaction=interaction)
+    refresher.mark_dirty(interaction.guild.id)
 
 
 @tree.command(
@@ -336,33 +319,20 @@ async def rename_group(interaction: discord.Interaction, group_id: int, new_name
 @check_permissions()
 async def add_user(interaction: discord.Interaction, group_id: int, user: discord.User, steam_name: str,
                    steam_profile: str):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute(f'SELECT name FROM groups WHERE id = {group_id}')
-    group_name = cursor.fetchone()[0]
+    group = await rosters.add_user(interaction.guild.id, group_id, user.id, str(user), steam_name, steam_profile)
 
-    if group_name is None:
+    if group is None:
         await interaction.response.send_message(
-            locale_text(locale=interaction.locale, message=f"Group with id `{group_id}` does not exist!"),
+            i18n.text(interaction.locale, 'group_not_found', group_id=group_id),
             ephemeral=True)
-        conn.close()
         return
+    group_name = group.name
 
-    cursor.execute(f'DELETE FROM users WHERE discord_id = {user.id}')
-    cursor.execute(f'''
-        INSERT INTO users (discord_id, discord_name, steam_name, steam_profile, group_id)
-        VALUES ({user.id}, "{str(user)}", "{steam_name}", "{steam_profile}", {group_id})
-    ''')
-    conn.commit()
-    conn.close()
-
-    await log(interaction=interaction,
-        msg=f'<@{interaction.user.id}> added user <@{user.id}> to group `{group_name}`')
+    log(interaction, 'log_user_added', actor=interaction.user.mention, user=user.mention, group=group_name)
 
     await interaction.response.send_message(
-        locale_text(locale=interaction.locale, message=f"User `{user}` added to group `{group_name}`!"), ephemeral=True)
-    await update_display_channel(interaction=interaction)
+        i18n.text(interaction.locale, 'user_added', user=user, group=group_name), ephemeral=True)
+    refresher.mark_dirty(interaction.guild.id)
 
 
 @tree.command(
@@ -371,18 +341,13 @@ async def add_user(interaction: discord.Interaction, group_id: int, user: discor
 )
 @check_permissions()
 async def remove_user(interaction: discord.Interaction, user: discord.User):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute(f'DELETE FROM users WHERE discord_id = {user.id}')
-    conn.commit()
-    conn.close()
+    await rosters.remove_user(interaction.guild.id, user.id)
 
-    await log(interaction=interaction,
-        msg=f'<@{interaction.user.id}> removed user <@{user.id}> from all groups')
+    log(interaction, 'log_user_removed', actor=interaction.user.mention, user=user.mention)
 
     await interaction.response.send_message(
-        locale_text(locale=interaction.locale, message=f"User `{user}` removed from all groups!"), ephemeral=True)
-    await update_display_channel(interaction=interaction)
+        i18n.text(interaction.locale, 'user_removed', user=user), ephemeral=True)
+    refresher.mark_dirty(interaction.guild.id)
 
 
 @tree.command(
@@ -391,29 +356,226 @@ async def remove_user(interaction: discord.Interaction, user: discord.User):
 )
 @check_permissions()
 async def move_user(interaction: discord.Interaction, user: discord.User, new_group_id: int):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+    group = await rosters.move_user(interaction.guild.id, user.id, new_group_id)
 
-    cursor.execute(f'SELECT name FROM groups WHERE id = {new_group_id}')
-    group_name = cursor.fetchone()[0]
-
-    if new_group_id is None:
+    if group is None:
         await interaction.response.send_message(
-            locale_text(locale=interaction.locale, message=f"Group with id `{new_group_id}` does not exist!"),
+            i18n.text(interaction.locale, 'group_not_found', group_id=new_group_id),
             ephemeral=True)
-        conn.close()
         return
+    group_name = group.name
 
-    cursor.execute(f'UPDATE users SET group_id = {new_group_id} WHERE discord_id = {user.id}')
-    conn.commit()
-    conn.close()
-
-    await log(interaction=interaction,
-        msg=f'<@{interaction.user.id}> moved user <@{user.id}> to `{group_name}`')
+    log(interaction, 'log_user_moved', actor=interaction.user.mention, user=user.mention, group=group_name)
 
     await interaction.response.send_message(
-        locale_text(locale=interaction.locale, message=f"User `{user}` moved to group `{group_name}`!"), ephemeral=True)
-    await update_display_channel(interaction=interaction)
+        i18n.text(interaction.locale, 'user_moved', user=user, group=group_name), ephemeral=True)
+    refresher.mark_dirty(interaction.guild.id)
+
+
+async def read_bulk_input(interaction: discord.Interaction, users: Optional[str],
+                          file: Optional[discord.Attachment]) -> Optional[str]:
+    """Text of the pasted list and the attached file; None after telling the user what was wrong."""
+    parts = [users] if users else []
+    if file is not None:
+        if file.size > bulk.MAX_FILE_SIZE:
+            await interaction.followup.send(
+                i18n.text(interaction.locale, 'bulk_file_too_large', limit=bulk.MAX_FILE_SIZE // 1024), ephemeral=True)
+            return None
+        try:
+            parts.append((await file.read()).decode('utf-8-sig'))
+        except UnicodeDecodeError:
+            await interaction.followup.send(i18n.text(interaction.locale, 'bulk_file_unreadable'), ephemeral=True)
+            return None
+    if not parts:
+        await interaction.followup.send(i18n.text(interaction.locale, 'bulk_no_input'), ephemeral=True)
+        return None
+    return '\n'.join(parts)
+
+
+def bulk_result(locale: discord.Locale, summary: str, errors: List[bulk.BulkError]) -> str:
+    if errors:
+        errors = sorted(errors, key=lambda error: error.line)
+        shown = [i18n.text(locale, 'bulk_skipped_entry', line=error.line,
+                           reason=i18n.text(locale, error.message_id, **error.args))
+                 for error in errors[:20]]
+        if len(errors) > len(shown):
+            shown.append(i18n.text(locale, 'bulk_skipped_more', count=len(errors) - len(shown)))
+        summary += '\n' + i18n.text(locale, 'bulk_skipped', count=len(errors), entries='\n'.join(shown))
+    return summary[:render.MESSAGE_LIMIT]
+
+
+async def send_bulk_result(interaction: discord.Interaction, summary: str, errors: List[bulk.BulkError]):
+    await interaction.followup.send(bulk_result(interaction.locale, summary, errors), ephemeral=True)
+
+
+@tree.command(name='bulk_add_users', description='Add many users to a group at once')
+@app_commands.describe(users='@user, steam name, steam profile; separated by semicolons',
+                       file='Text or CSV file with one user per line')
+@check_permissions()
+async def bulk_add_users(interaction: discord.Interaction, group_id: int, users: Optional[str] = None,
+                         file: Optional[discord.Attachment] = None):
+    await interaction.response.defer(ephemeral=True)
+    text = await read_bulk_input(interaction, users, file)
+    if text is None:
+        return
+
+    entries, errors = bulk.parse_entries(text)
+    if len(entries) > bulk.MAX_ENTRIES:
+        await interaction.followup.send(
+            i18n.text(interaction.locale, 'bulk_too_many', limit=bulk.MAX_ENTRIES, count=len(entries)), ephemeral=True)
+        return
+
+    resolved = await resolver.resolve(interaction.guild, [entry.discord_id for entry in entries])
+    known = []
+    for entry in entries:
+        user = resolved.get(entry.discord_id)
+        if user is None:
+            errors.append(bulk.BulkError(entry.line, 'bulk_error_unknown_user', {'user': entry.discord_id}))
+        else:
+            known.append((entry.discord_id, str(user), entry.steam_name, entry.steam_profile))
+
+    group = await rosters.add_users(interaction.guild.id, group_id, known)
+    if group is None:
+        await interaction.followup.send(
+            i18n.text(interaction.locale, 'group_not_found', group_id=group_id), ephemeral=True)
+        return
+
+    added = [user[0] for user in known]
+    if added:
+        log(interaction, 'log_users_added', actor=interaction.user.mention, count=len(added), group=group.name,
+            users=bulk.mention_list(added))
+        refresher.mark_dirty(interaction.guild.id)
+    await send_bulk_result(interaction, i18n.text(interaction.locale, 'bulk_users_added', count=len(added),
+                                                  group=group.name), errors)
+
+
+@tree.command(name='bulk_move_users', description='Move many users to a group at once')
+@app_commands.describe(users='User mentions or ids', file='Text or CSV file with one user per line')
+@check_permissions()
+async def bulk_move_users(interaction: discord.Interaction, new_group_id: int, users: Optional[str] = None,
+                          file: Optional[discord.Attachment] = None):
+    await interaction.response.defer(ephemeral=True)
+    text = await read_bulk_input(interaction, users, file)
+    if text is None:
+        return
+
+    discord_ids = bulk.parse_users(text)
+    if len(discord_ids) > bulk.MAX_ENTRIES:
+        await interaction.followup.send(
+            i18n.text(interaction.locale, 'bulk_too_many', limit=bulk.MAX_ENTRIES, count=len(discord_ids)),
+            ephemeral=True)
+        return
+
+    result = await rosters.move_users(interaction.guild.id, discord_ids, new_group_id)
+    if result is None:
+        await interaction.followup.send(
+            i18n.text(interaction.locale, 'group_not_found', group_id=new_group_id), ephemeral=True)
+        return
+    group, moved = result
+
+    if moved:
+        log(interaction, 'log_users_moved', actor=interaction.user.mention, count=len(moved), group=group.name,
+            users=bulk.mention_list(moved))
+        refresher.mark_dirty(interaction.guild.id)
+    moved_ids = set(moved)
+    errors = [bulk.BulkError(number, 'bulk_error_not_in_group', {'user': discord_id})
+              for number, discord_id in enumerate(discord_ids, start=1) if discord_id not in moved_ids]
+    await send_bulk_result(interaction, i18n.text(interaction.locale, 'bulk_users_moved', count=len(moved),
+                                                  group=group.name), errors)
+
+
+@tree.command(name='bulk_remove_users', description='Remove many users from all groups at once')
+@app_commands.describe(users='User mentions or ids', file='Text or CSV file with one user per line')
+@check_permissions()
+async def bulk_remove_users(interaction: discord.Interaction, users: Optional[str] = None,
+                            file: Optional[discord.Attachment] = None):
+    await interaction.response.defer(ephemeral=True)
+    text = await read_bulk_input(interaction, users, file)
+    if text is None:
+        return
+
+    discord_ids = bulk.parse_users(text)
+    if len(discord_ids) > bulk.MAX_ENTRIES:
+        await interaction.followup.send(
+            i18n.text(interaction.locale, 'bulk_too_many', limit=bulk.MAX_ENTRIES, count=len(discord_ids)),
+            ephemeral=True)
+        return
+
+    removed = await rosters.remove_users(interaction.guild.id, discord_ids)
+    if removed:
+        log(interaction, 'log_users_removed', actor=interaction.user.mention, count=len(removed),
+            users=bulk.mention_list(removed))
+        refresher.mark_dirty(interaction.guild.id)
+    removed_ids = set(removed)
+    errors = [bulk.BulkError(number, 'bulk_error_not_in_group', {'user': discord_id})
+              for number, discord_id in enumerate(discord_ids, start=1) if discord_id not in removed_ids]
+    await send_bulk_result(interaction, i18n.text(interaction.locale, 'bulk_users_removed', count=len(removed)),
+                           errors)
+
+
+# Seconds between progress updates of a running import
+IMPORT_PROGRESS_INTERVAL = 1.0
+imports_running = set()
+
+
+@tree.command(name='import_roster', description='Import groups and users from a CSV or JSON file')
+@app_commands.describe(file='CSV or JSON roster, as produced by /load_data, optionally gzip compressed')
+@check_permissions()
+async def import_roster(interaction: discord.Interaction, file: discord.Attachment):
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    locale = interaction.locale
+    guild_id = interaction.guild.id
+    if file.size > importer.MAX_FILE_SIZE:
+        await interaction.followup.send(
+            i18n.text(locale, 'import_too_large', limit=importer.MAX_FILE_SIZE // 2 ** 20), ephemeral=True)
+        return
+    if guild_id in imports_running:
+        await interaction.followup.send(i18n.text(locale, 'import_running'), ephemeral=True)
+        return
+
+    last_progress = time.monotonic()
+
+    async def progress(rows: int, errors: int):
+        nonlocal last_progress
+        if time.monotonic() - last_progress >= IMPORT_PROGRESS_INTERVAL:
+            last_progress = time.monotonic()
+            await interaction.edit_original_response(content=i18n.text(locale, 'import_progress', rows=rows,
+                                                                       errors=errors))
+
+    async def resolve(discord_ids: List[int]):
+        resolved = await resolver.resolve(interaction.guild, discord_ids)
+        return {discord_id: str(user) for discord_id, user in resolved.items()}
+
+    filename = file.filename.lower()
+    chunks = importer.stream_text(file.url, filename.endswith('.gz'))
+    if filename.endswith(('.json', '.json.gz')):
+        records = importer.json_records(chunks)
+    else:
+        records = importer.csv_records(chunks)
+    imports_running.add(guild_id)
+    staging = importer.Staging(db, guild_id)
+    try:
+        errors = await importer.stage_records(records, staging, resolve, progress)
+        created, imported = await rosters.merge_import(guild_id, staging.import_id) if staging.rows else (0, 0)
+    except importer.ImportAborted as e:
+        await interaction.edit_original_response(content=i18n.text(locale, e.message_id, **e.kwargs))
+        return
+    except aiohttp.ClientError as e:
+        logger.warning(f'Could not download import file {file.url}: {e}')
+        await interaction.edit_original_response(content=i18n.text(locale, 'import_download_failed'))
+        return
+    finally:
+        # Closes the download even when the import stopped half way through the file
+        await records.aclose()
+        await chunks.aclose()
+        await staging.discard()
+        imports_running.discard(guild_id)
+
+    if imported or created:
+        log(interaction, 'log_roster_imported', actor=interaction.user.mention, count=imported, groups=created)
+        refresher.mark_dirty(guild_id)
+    await interaction.edit_original_response(
+        content=bulk_result(locale, i18n.text(locale, 'import_done', count=imported, groups=created), errors))
 
 
 @tree.command(
@@ -422,141 +584,106 @@ async def move_user(interaction: discord.Interaction, user: discord.User, new_gr
 )
 @check_permissions()
 async def list_groups(interaction: discord.Interaction):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name, priority FROM groups')
-    groups = cursor.fetchall()
-    conn.close()
+    groups = (await rosters.get(interaction.guild.id)).ordered_groups()
 
     if groups:
         group_list = "\n".join(
-            [locale_text(locale=interaction.locale, message=f'**{group[0]}.** `{group[1]}` : *priority = `{group[2]}`*')
+            [i18n.text(interaction.locale, 'group_list_entry', id=group.id, name=group.name, priority=group.priority)
              for group in groups])
         await interaction.response.send_message(
-            locale_text(locale=interaction.locale, message=f"Existing groups:\n{group_list}"), ephemeral=True)
+            i18n.text(interaction.locale, 'group_list', groups=group_list), ephemeral=True)
     else:
-        await interaction.response.send_message(locale_text(locale=interaction.locale, message="No groups found."),
-                                                ephemeral=True)
+        await interaction.response.send_message(i18n.text(interaction.locale, 'no_groups'), ephemeral=True)
 
 
 @tree.command(name='sync', description='Owner only')
 async def sync(interaction: discord.Interaction):
-    await tree.set_translator(Translator())
-    await tree.sync()
-    await interaction.response.send_message(locale_text(locale=interaction.locale, message='Commands syncronized'),
-                                            ephemeral=True)
+    await sync_commands(force=True)
+    await interaction.response.send_message(i18n.text(interaction.locale, 'commands_synced'), ephemeral=True)
 
 
 @tree.command(name='update_list', description='Update group list in chanel')
 @check_permissions()
 async def update_list(interaction: discord.Interaction):
-    await update_display_channel(interaction=interaction)
-    await interaction.response.send_message(locale_text(locale=interaction.locale, message='Group list updated!'),
-                                            ephemeral=True)
-    await log(interaction=interaction,
-              msg=f'<@{interaction.user.id}> updated group list channel')
+    await interaction.response.send_message(i18n.text(interaction.locale, 'group_list_updated'), ephemeral=True)
+    refresher.mark_dirty(interaction.guild.id, force=True)
+    log(interaction, 'log_group_list_updated', actor=interaction.user.mention)
 
 
 @tree.command(name='set_permissions', description='Set roles that will have access to bot commands')
 @discord.app_commands.checks.has_permissions(administrator=True)
 async def set_permissions(interaction: discord.Interaction, role: discord.Role):
-    guild_id = interaction.guild.id
-    role_id = role.id
-
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT * FROM permissions WHERE guild_id = ? AND role_id = ?', (guild_id, role_id))
-    data = cursor.fetchone()
+    allowed = await rosters.allow_role(interaction.guild.id, role.id)
 
-    await log(interaction=interaction,
-        msg=f'<@{interaction.user.id}> set access to <@&{role.id}>')
+    log(interaction, 'log_access_granted', actor=interaction.user.mention, role=role.mention)
 
-    if data is None:
-        cursor.execute('INSERT INTO permissions (guild_id, role_id) VALUES (?, ?)', (guild_id, role_id))
-        conn.commit()
+    if allowed:
         await interaction.response.send_message(
-            locale_text(locale=interaction.locale, message=f'`{role.name}` now have access to bot commands'),
+            i18n.text(interaction.locale, 'access_granted', role=role.name),
             ephemeral=True)
     else:
-        interaction.response.send_message(
-            locale_text(locale=interaction.locale, message=f'`{role.name}` already had access to commands'),
+        await interaction.response.send_message(
+            i18n.text(interaction.locale, 'access_already_granted', role=role.name),
             ephemeral=True)
 
 
 @tree.command(name='remove_permissions', description="Remove the role's access to bot commands")
 @discord.app_commands.checks.has_permissions(administrator=True)
 async def remove_permissions(interaction: discord.Interaction, role: discord.Role):
-    guild_id = interaction.guild.id
-    role_id = role.id
+    denied = await rosters.deny_role(interaction.guild.id, role.id)
 
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+    log(interaction, 'log_access_removed', actor=interaction.user.mention, role=role.mention)
 
-    cursor.execute(f'SELECT * FROM permissions WHERE guild_id = {guild_id} AND role_id = {role_id}')
-    data = cursor.fetchone()
-
-    await log(interaction=interaction,
-        msg=f'<@{interaction.user.id}> removed access from <@&{role.id}>')
-
-    if data is None:
+    if not denied:
 
         await interaction.response.send_message(
-            locale_text(locale=interaction.locale, message=f'`{role.name}` did not have access to bot commands'),
+            i18n.text(interaction.locale, 'access_not_granted', role=role.name),
             ephemeral=True)
     else:
-        cursor.execute(f'DELETE FROM permissions WHERE guild_id = {guild_id} and role_id = {role_id})')
-        conn.commit()
         await interaction.response.send_message(
-            locale_text(locale=interaction.locale,
-                        message=f'`{role.name}` rights to use bot commands have been removed'),
+            i18n.text(interaction.locale, 'access_removed', role=role.name),
             ephemeral=True)
 
 
 @tree.command(name='list_permissions', description="Get roles list have access to bot commands")
 @discord.app_commands.checks.has_permissions(administrator=True)
 async def list_permissions(interaction: discord.Interaction):
-    guild_id = interaction.guild.id
-
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute(f'SELECT * FROM permissions WHERE guild_id = {guild_id}')
-    roles = cursor.fetchall()
+    allowed_roles = (await rosters.get(interaction.guild.id)).allowed_roles
+    roles = [role for role in (interaction.guild.get_role(role_id) for role_id in allowed_roles) if role is not None]
 
     if len(roles) <= 0:
 
-        await interaction.response.send_message(locale_text(locale=interaction.locale,
-                                                            message=f'There is no roles have access to bot commands in this server'),
-                                                ephemeral=True)
+        await interaction.response.send_message(i18n.text(interaction.locale, 'no_allowed_roles'), ephemeral=True)
     else:
         roles_list = "\n".join(
-            [locale_text(locale=interaction.locale,
-                         message=f'**{get(interaction.guild.roles, id=role[1]).id}** `{get(interaction.guild.roles, id=role[1]).name}`')
-             for role in roles])
+            [i18n.text(interaction.locale, 'allowed_role_entry', id=role.id, name=role.name) for role in roles])
         await interaction.response.send_message(
-            locale_text(locale=interaction.locale, message=f"Roles have access to bot commands:\n{roles_list}"),
-            ephemeral=True)
+            i18n.text(interaction.locale, 'allowed_roles', roles=roles_list), ephemeral=True)
+
+
+@tree.command(name='metrics', description='Show bot performance metrics')
+@discord.app_commands.checks.has_permissions(administrator=True)
+async def show_metrics(interaction: discord.Interaction):
+    await interaction.response.send_message(metrics.summary(), ephemeral=True)
 
 
 @add_user.autocomplete("group_id")
+@bulk_add_users.autocomplete("group_id")
+@bulk_move_users.autocomplete("new_group_id")
 @rename_group.autocomplete("group_id")
 @delete_group.autocomplete("group_id")
 @move_user.autocomplete("new_group_id")
 async def group_autocomplete(interaction: discord.Interaction, current: str):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute(f'SELECT id, name FROM groups WHERE name LIKE ?', ('%' + current + '%',))
-    groups = cursor.fetchall()
-    conn.close()
-
-    data = []
-    for group in groups:
-        data.append(app_commands.Choice(name=group[1], value=group[0]))
+    groups = (await rosters.get(interaction.guild.id)).search_groups(current)
 
-    return data
+    return [app_commands.Choice(name=group.name, value=group.id) for group in groups]
 
 
+@import_roster.error
+@show_metrics.error
+@bulk_remove_users.error
+@bulk_move_users.error
+@bulk_add_users.error
 @remove_permissions.error
 @list_permissions.error
 @set_permissions.error
@@ -572,11 +699,14 @@ async def group_autocomplete(interaction: discord.Interaction, current: str):
 @set_display_channel.error
 @load_data.error
 async def on_error(interaction: discord.Interaction, error):
+    observe_command(interaction, 'error')
+    # Deferred commands have to answer through the followup webhook
+    send_message = interaction.followup.send if interaction.response.is_done() else interaction.response.send_message
     if isinstance(error, discord.app_commands.errors.MissingPermissions) or isinstance(error, commands.CheckFailure):
-        await interaction.response.send_message(locale_text(locale=interaction.locale, message="You do not have permission to use this command."), ephemeral=True)
+        await send_message(i18n.text(interaction.locale, 'no_permission'), ephemeral=True)
     elif isinstance(error, discord.Forbidden):
-        await interaction.response.send_message(
-            locale_text(locale=interaction.locale, message="I cannot send messages to you. Please check your privacy settings."),
+        await send_message(
+            i18n.text(interaction.locale, 'dm_forbidden'),
             ephemeral=True
         )
     else:
@@ -584,190 +714,105 @@ async def on_error(interaction: discord.Interaction, error):
         raise error
 
 
-def locale_text(locale: discord.Locale, message: str) -> str:
-    if locale is discord.Locale.russian:
-        if 'Sent the database file in private messages.' in message:
-            message = message.replace('Sent the database file in private messages.', 'Отправил файл базы данных в личные сообщения.')
-        if 'Commands syncronized' in message:
-            message = message.replace('Commands syncronized', 'Команды синхронизированы')
-        if 'priority' in message:
-            message = message.replace('priority', 'приоритет')
-        if 'Existing groups:' in message:
-            message = message.replace('Existing groups:', 'Список групп:')
-        if 'No groups found.' in message:
-            message = message.replace('No groups found.', 'Группы не найдены.')
-        if 'Group with id' in message:
-            message = message.replace('Group with id', 'Группа с идентификатором')
-        if 'does not exist!' in message:
-            message = message.replace('does not exist!', 'не существует!')
-        if 'Group list updated!' in message:
-            message.replace('Group list updated!', 'Список участников обновлён!')
-        if 'User' in message:
-            message = message.replace('User', 'Пользователь')
-        if 'Group' in message:
-            message = message.replace('Group', 'Группа')
-        if 'moved to group' in message:
-            message = message.replace('moved to group', 'перемещён в группу')
-        if 'removed from all groups!' in message:
-            message = message.replace('removed from all groups!', 'удалён из всех групп!')
-        if 'added to group' in message:
-            message = message.replace('added to group', 'добавлен в группу')
-        if 'renamed to' in message:
-            message = message.replace('renamed to', 'переименована в')
-        if 'deleted' in message:
-            message = message.replace('deleted', 'удалена')
-        if 'created' in message:
-            message = message.replace('created', 'создана')
-        if 'Display channel set to' in message:
-            message = message.replace('Display channel set to', 'Канал отображения установлен в')
-        if "now have access to bot commands" in message:
-            message = message.replace('now have access to bot commands', 'теперь имеет доступ к командам бота')
-        if 'You do not have permission to use this command.' in message:
-            message = message.replace('You do not have permission to use this command.', 'У вас нет прав на использование данной команды.')
-        if 'Roles have access to bot commands:' in message:
-            message = message.replace('Roles have access to bot commands:', 'Роли, имеющие доступ к командам бота')
-        if 'rights to use bot commands have been removed':
-            message = message.replace('rights to use bot commands have been removed', 'права на использование команд бота были отозваны')
-        if 'did not have access to bot commands':
-            message = message.replace('did not have access to bot commands', 'не имел прав на использование команд бота')
-        if 'already had access to commands':
-            message = message.replace('already had access to commands', 'уже имеет доступ к командам бота')
-        if 'There is no roles have access to bot commands in this server':
-            message = message.replace('There is no roles have access to bot commands in this server', 'На этом сервере нет ролей, которым был бы разрешён доступ к командам бота')
-        if 'set display chat to' in message:
-            message = message.replace('set display chat to', 'установил канал для отображения списка в')
-        if 'Logging chat now in' in message:
-            message = message.replace('Logging chat now in', 'Канал для логов теперь в')
-        if 'created a group' in message:
-            message = message.replace('created a group', 'создал группу')
-        if 'with priority' in message:
-            message = message.replace('with priority', 'с приоритетом')
-        if 'deleted group' in message:
-            message = message.replace('deleted group', 'удалил группу')
-        if 'renamed group' in message:
-            message = message.replace('renamed group', 'переименовал группу')
-        if 'to group' in message:
-            message = message.replace('to group', 'в группу')
-        if 'I cannot send messages to you. Please check your privacy settings.' in message:
-            message = message.replace('I cannot send messages to you. Please check your privacy settings.', 'Не могу отправить Вам приватное сообщение. Проверьте настройки приватности.')
-        if 'to' in message:
-            message = message.replace('to', 'в')
-        if 'added user' in message:
-            message = message.replace('added user', 'добавил пользователя')
-        if 'removed user' in message:
-            message = message.replace('removed user', 'удалил пользователя')
-        if 'from all groups' in message:
-            message = message.replace('from all groups', 'из всех групп')
-        if 'moved user' in message:
-            message = message.replace('moved user', 'переместил пользователя')
-        if 'updated group list channel' in message:
-            message = message.replace('updated group list channel', 'обновил канал с группами')
-        if 'set access to' in message:
-            message = message.replace('set access to', 'добавил доступ к боту для')
-        if 'removed access from' in message:
-            message = message.replace('removed access from', 'удалил доступ к боту у')
-    return message
-
-
-class Translator(app_commands.Translator):
-    async def translate(
-            self,
-            string: app_commands.locale_str,
-            locale: discord.Locale,
-            context: app_commands.TranslationContext,
-    ) -> str | None:
-        message = str(string)
-        if locale is discord.Locale.russian:
-            if message == 'sync':
-                return 'синхронизация'
-            elif message == 'Owner only':
-                return 'Только для владельца сервера'
-            elif message == 'list_groups':
-                return 'список_групп'
-            elif message == "priority":
-                return "приоритет"
-            elif message == 'move_user':
-                return 'переместить_пользователя'
-            elif message == 'Move a user to a different group':
-                return 'Переместить пользователя в другую группу'
-            elif message == 'user':
-                return 'пользователь'
-            elif message == 'new_group_id':
-                return 'новая_группа'
-            elif message == 'List all existing groups':
-                return 'Список всех существующих групп'
-            elif message == 'group_id':
-                return "группа"
-            elif message == 'steam_name':
-                return "имя_в_стиме"
-            elif message == 'steam_profile':
-                return "ссылка_на_стим"
-            elif message == 'group_name':
-                return "название_группы"
-            elif message == 'display_channel':
-                return "канал_для_списка"
-            elif message == 'logging_channel':
-                return "канал_для_логов"
-            elif message == 'role':
-                return 'роль'
-            elif message == 'new_name':
-                return "новое_название"
-            elif message == 'remove_user':
-                return 'удалить_пользователя'
-            elif message == 'Remove a user from all groups':
-                return 'Удалить пользователя из всех групп'
-            elif message == 'add_user':
-                return 'добавить_пользователя'
-            elif message == 'Add a user to a group':
-                return 'Добавить пользователя в группу'
-            elif message == 'rename_group':
-                return 'изменить_группу'
-            elif message == 'Rename an existing group':
-                return 'Изменить название и приоритет существующей группы'
-            elif message == 'delete_group':
-                return 'удалить_группу'
-            elif message == 'Delete an existing group':
-                return 'Удалить существующую группу'
-            elif message == 'create_group':
-                return 'создать_группу'
-            elif message == 'Create a new group':
-                return 'Создать новую группу'
-            elif message == 'set_display_channel':
-                return 'установить_канал'
-            elif message == 'Set the channel to display the group list':
-                return 'Установить канал, в котором будет отображаться и обновляться список участников всех групп'
-            elif message == 'update_list':
-                return 'обновить_список'
-            elif message == 'Update group list in chanel':
-                return 'Обновить список участников в закреплённом канале'
-            elif message == 'list_permissions':
-                return 'список_разрешённых'
-            elif message == 'Get roles list have access to bot commands':
-                return 'Показать список ролей, которым разрешён доступ к командам'
-            elif message == 'remove_permissions':
-                return 'запретить_доступ'
-            elif message == "Remove the role's access to bot commands":
-                return 'Запретить доступ к командам бота для роли'
-            elif message == 'set_permissions':
-                return 'разрешить_доступ'
-            elif message == 'Set roles that will have access to bot commands':
-                return 'Разрешить доступ к командам бота для роли'
-            elif message == 'load_data':
-                return 'скачать_базу_данных'
-            elif message == 'Load data file':
-                return 'Скачать файл базы данных с актуальными данными'
-            elif message == 'logging_chat':
-                return 'канал_для_логов'
+@client.event
+async def setup_hook():
+    await init_db()
+    # Runs once per process, unlike on_ready which fires again after reconnects
+    if SHARD_IDS is None or 0 in SHARD_IDS:
+        try:
+            await sync_commands()
+        except discord.HTTPException as e:
+            logger.error(f'Could not sync the command tree: {e}')
+    else:
+        # The process running shard 0 syncs the commands, the others only need the translations
+        await tree.set_translator(i18n.Translator())
+    if getattr(env, 'metrics_port', None):
+        # Processes running separate shard ranges on one host each get their own port
+        port = env.metrics_port + (SHARD_IDS[0] if SHARD_IDS else 0)
+        await metrics.serve(getattr(env, 'metrics_host', '127.0.0.1'), port)
 
-        return None
+
+@client.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    observe_command(interaction, 'ok')
+
+
+@client.event
+async def on_interaction(interaction: discord.Interaction):
+    # Let the response go out before the guild's queued list maintenance; autocomplete is not worth waiting for
+    if interaction.type != discord.InteractionType.autocomplete:
+        rest.hold_background(interaction.guild_id)
+
+
+@client.event
+async def on_message(message: discord.Message):
+    if message.guild is None or message.author == client.user:
+        return
+    guild_roster = rosters.peek(message.guild.id)
+    if guild_roster is None or message.channel.id != guild_roster.display_channel_id:
+        return
+    # Someone wrote into the display channel, our message map no longer describes it
+    await display_map.invalidate(message.guild.id)
+    refresher.mark_dirty(message.guild.id)
+
+
+async def refresh_members(guild_id: int, names: Dict[int, str], departed: List[int] = ()):
+    if await rosters.refresh_members(guild_id, names, departed):
+        refresher.mark_dirty(guild_id)
+
+
+@client.event
+async def on_guild_available(guild: discord.Guild):
+    # Catches up on joins, leaves and renames that happened while the bot was offline
+    tracked = list((await rosters.get(guild.id)).members)
+    if not tracked:
+        return
+    present = await resolver.fetch_members(guild, tracked)
+    if present is None:
+        return
+    await refresh_members(guild.id, {discord_id: str(member) for discord_id, member in present.items()},
+                          [discord_id for discord_id in tracked if discord_id not in present])
+
+
+@client.event
+async def on_member_join(member: discord.Member):
+    await refresh_members(member.guild.id, {member.id: str(member)})
+
+
+@client.event
+async def on_user_update(before: discord.User, after: discord.User):
+    # Names are stored as str(user), which only changes with the account, not with the server nickname
+    if str(before) == str(after):
+        return
+    for guild in after.mutual_guilds:
+        await refresh_members(guild.id, {after.id: str(after)})
+
+
+@client.event
+async def on_raw_member_remove(payload: discord.RawMemberRemoveEvent):
+    # The raw event also fires for members that were never cached
+    await refresh_members(payload.guild_id, {}, [payload.user.id])
+
+
+@client.event
+async def on_member_ban(guild: discord.Guild, user: Union[discord.User, discord.Member]):
+    await refresh_members(guild.id, {}, [user.id])
+
+
+@client.event
+async def on_guild_role_delete(role: discord.Role):
+    await rosters.forget_role(role.guild.id, role.id)
 
 
 @client.event
 async def on_ready():
-    await tree.set_translator(Translator())
-    await tree.sync()
     logger.info(f'Logged in as {client.user.name} (ID: {client.user.id})')
 
 
-init_db()
-client.run(env.token)
+@client.event
+async def on_shard_ready(shard_id: int):
+    logger.info(f'Shard {shard_id}/{client.shard_count} ready')
+
+
+if __name__ == '__main__':
+    client.run(env.token)
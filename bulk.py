@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import csv
+import re
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import members
+
+# Upper bound of users one bulk command may touch
+MAX_ENTRIES = 500
+# Attachments larger than this are refused before they are downloaded
+MAX_FILE_SIZE = 256 * 1024
+
+_USER = re.compile(r'^\s*(?:<@!?(\d+)>|(\d{15,20}))\s*$')
+_USERS = re.compile(r'<@!?(\d+)>|\b(\d{15,20})\b')
+_ENTRY_SEPARATOR = re.compile(r'[;\n]')
+
+
+class BulkEntry(NamedTuple):
+    line: int
+    discord_id: int
+    steam_name: str
+    steam_profile: str
+
+
+class BulkError(NamedTuple):
+    """A rejected input line; ``message_id`` and ``args`` describe the reason for i18n.text."""
+    line: int
+    message_id: str
+    args: Dict[str, Any]
+
+
+def parse_users(text: str) -> List[int]:
+    """Every user mention or raw id in the text, in order and without duplicates."""
+    return list(dict.fromkeys(int(mention or raw) for mention, raw in _USERS.findall(text)))
+
+
+def parse_entries(text: str) -> Tuple[List[BulkEntry], List[BulkError]]:
+    """Parse ``user, steam name, steam profile`` entries separated by new lines or semicolons.
+
+    Later entries for the same user replace earlier ones.
+    """
+    entries: Dict[int, BulkEntry] = {}
+    errors = []
+    lines = _ENTRY_SEPARATOR.split(text.replace('\r', ''))
+    for number, row in enumerate(csv.reader(lines, skipinitialspace=True), start=1):
+        if not row or not any(field.strip() for field in row):
+            continue
+        if len(row) != 3:
+            errors.append(BulkError(number, 'bulk_error_format', {}))
+            continue
+        user, steam_name, steam_profile = (field.strip() for field in row)
+        match = _USER.match(user)
+        if match is None or not steam_name or not steam_profile:
+            errors.append(BulkError(number, 'bulk_error_format', {}))
+            continue
+        discord_id = int(match.group(1) or match.group(2))
+        entries.pop(discord_id, None)
+        entries[discord_id] = BulkEntry(number, discord_id, steam_name, steam_profile)
+    return list(entries.values()), errors
+
+
+def mention_list(discord_ids: List[int], limit: int = 40) -> str:
+    mentions = ', '.join(members.mention(discord_id) for discord_id in discord_ids[:limit])
+    if len(discord_ids) > limit:
+        mentions += f' (+{len(discord_ids) - limit})'
+    return mentions
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence, TypeVar
+
+import metrics
+
+T = TypeVar('T')
+
+
+class Database:
+    """One long-lived SQLite connection owned by a dedicated thread.
+
+    Every query is shipped to that thread, so the event loop never blocks on disk I/O and statements
+    never run concurrently on the connection. Multi-statement work goes through :meth:`transaction`,
+    which runs the whole callable in one job between ``BEGIN`` and ``COMMIT``.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database')
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self):
+        # Autocommit mode, transactions are opened explicitly
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, cached_statements=256)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        self._conn = conn
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _call(self, fn: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+
+        def job():
+            metrics.registry.observe('db_wait_seconds', time.perf_counter() - submitted)
+            return fn(*args)
+        return await loop.run_in_executor(self._executor, job)
+
+    async def open(self):
+        await self._call(self._connect)
+
+    async def close(self):
+        await self._call(self._close)
+        self._executor.shutdown(wait=True)
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> int:
+        """Run a single statement and return the number of affected rows."""
+        return await self._call(self._timed, sql, lambda: self._conn.execute(sql, params).rowcount)
+
+    async def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[tuple]:
+        return await self._call(self._timed, sql, lambda: self._conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+        return await self._call(self._timed, sql, lambda: self._conn.execute(sql, params).fetchall())
+
+    @staticmethod
+    def _timed(sql: str, fn: Callable[[], T]) -> T:
+        with metrics.registry.timer('db_query_seconds', query=metrics.statement_label(sql)):
+            return fn()
+
+    def _transaction(self, fn: Callable[[sqlite3.Cursor], T]) -> T:
+        with metrics.registry.timer('db_query_seconds', query=f'transaction {fn.__name__}'):
+            cursor = self._conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn(cursor)
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+            return result
+
+    async def transaction(self, fn: Callable[[sqlite3.Cursor], T]) -> T:
+        """Run ``fn(cursor)`` atomically; any exception rolls the whole transaction back."""
+        return await self._call(self._transaction, fn)
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import os
+import re
+from typing import List
+
+import discord
+
+import members
+import render
+import roster
+
+LOGO_PATH = 'logo.png'
+DOTS = "..........................................................................................................................................."
+SEPARATOR = """** **
+▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒
+** **"""
+TITLE = """⫘⫘⫘⫘⫘⫘⫘ **A S T R A   M I L I T A R U M** ⫘⫘⫘⫘⫘⫘⫘
+
+▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒▒
+** **"""
+
+
+def group_lines(group: roster.Group, start: int = 1) -> List[render.Line]:
+    lines = [render.Line(f"⫘⫘⫘⫘⫘⫘⫘⫘⫘ `{group.name}` ⫘⫘⫘⫘⫘⫘⫘⫘⫘", keep_with_next=True)]
+    for number, member in enumerate(group.members, start=start):
+        steam = f'<{member.steam_profile}>' if re.search("(https?://[\w.-]+)", member.steam_profile) else member.steam_profile
+        if member.left_at is None:
+            user = members.mention(member.discord_id)
+        else:
+            # A mention of somebody who left renders as an unknown user, show the last known name instead
+            user = f'~~{discord.utils.escape_markdown(member.discord_name)}~~'
+        lines.append(render.Line(f"{number}. {user} - {member.steam_name} - {steam}"))
+    lines.append(render.Line(SEPARATOR))
+    return lines
+
+
+def blocks(guild_roster: roster.Roster, layout: str = 'groups') -> List[render.Block]:
+    """The display channel of a roster: logo, title and the groups in the given layout."""
+    result = []
+    if os.path.exists(LOGO_PATH):
+        result.append(render.Block('logo', messages=[render.DisplayMessage(content=DOTS, file=LOGO_PATH),
+                                                     render.DisplayMessage(content=DOTS)]))
+    result.append(render.Block('title', lines=[render.Line(TITLE)]))
+
+    if layout == 'compact':
+        # One block for the whole roster, numbered straight through
+        lines = []
+        user_count = 1
+        for group in guild_roster.ordered_groups():
+            lines.extend(group_lines(group, start=user_count))
+            user_count += len(group.members)
+        result.append(render.Block('roster', lines=lines))
+    else:
+        result.extend(render.Block(f'group:{group.id}', lines=group_lines(group))
+                      for group in guild_roster.ordered_groups())
+    return result
@@ -1 +1,26 @@
-token = "YOUR_TOKEN_HERE"
\ No newline at end of file
+token = "YOUR_TOKEN_HERE"
+
+# Seconds without roster changes before the display channel is re-rendered
+refresh_quiet_window = 2.0
+# Longest a pending change may wait for a re-render while officers keep editing
+refresh_max_delay = 10.0
+# 'groups' gives every group its own messages so an edit only touches that group, 'compact' uses fewer messages
+display_layout = 'groups'
+# Local Prometheus endpoint at http://metrics_host:metrics_port/metrics, off while metrics_port is None (e.g. 9464)
+metrics_host = '127.0.0.1'
+metrics_port = None
+# Shards this process connects, e.g. [0, 1, 2, 3] with shard_count = 8; None runs every shard in this process.
+# Processes running different shards of the same shard_count can share the database.
+# The BOT_SHARD_IDS ('0-3') and BOT_SHARD_COUNT environment variables override both
+shard_ids = None
+# Total number of shards, None lets Discord recommend one; required when shard_ids is set
+shard_count = None
+# Displays of one shard that may be re-rendered at the same time
+render_workers = 2
+# True hands display rendering to separate `python worker.py` processes through a queue in the database
+render_worker = False
+# Requests per second all processes of the bot send together, below Discord's global limit of 50
+global_rate = 40
+# Part of global_rate that goes to the render workers while render_worker is True, split it with
+# `--global-rate` when several workers run
+render_worker_rate = 20
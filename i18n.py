@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+from typing import Callable, Dict, Optional
+
+import discord
+from discord import app_commands
+
+# Message catalog, keyed by message id. English is the fallback for every locale and every missing id.
+MESSAGES: Dict[str, Dict[str, str]] = {
+    'en': {
+        'database_sent': 'Sent the database file in private messages.',
+        'export_sent': 'Sent the roster export in private messages.',
+        'export_too_large': 'The export is {size} MB, over the {limit} MB attachment limit.',
+        'dm_forbidden': 'I cannot send messages to you. Please check your privacy settings.',
+        'no_permission': 'You do not have permission to use this command.',
+        'commands_synced': 'Commands synchronized',
+        'display_channel_set': 'Display channel set to {channel}',
+        'group_exists': 'Group `{group}` already exists!',
+        'group_not_found': 'Group with id `{group_id}` does not exist!',
+        'group_created': 'Group `{group}` created!',
+        'group_deleted': 'Group `{group}` deleted!',
+        'group_renamed': 'Group `{group}` renamed to `{new_name}`!',
+        'group_list': 'Existing groups:\n{groups}',
+        'group_list_entry': '**{id}.** `{name}` : *priority = `{priority}`*',
+        'no_groups': 'No groups found.',
+        'group_list_updated': 'Group list updated!',
+        'user_added': 'User `{user}` added to group `{group}`!',
+        'user_removed': 'User `{user}` removed from all groups!',
+        'user_moved': 'User `{user}` moved to group `{group}`!',
+        'access_granted': '`{role}` now have access to bot commands',
+        'access_already_granted': '`{role}` already had access to commands',
+        'access_removed': '`{role}` rights to use bot commands have been removed',
+        'access_not_granted': '`{role}` did not have access to bot commands',
+        'allowed_roles': 'Roles have access to bot commands:\n{roles}',
+        'allowed_role_entry': '**{id}** `{name}`',
+        'no_allowed_roles': 'There is no roles have access to bot commands in this server',
+        'log_display_channel_set': '{actor} set display chat to {channel}.',
+        'log_display_and_logging_channel_set': '{actor} set display chat to {channel}. Logging chat now in {logging_channel}',
+        'log_group_created': '{actor} created a group `{group}` with priority `{priority}`',
+        'log_group_deleted': '{actor} deleted group `{group}`',
+        'log_group_renamed': '{actor} renamed group `{group}` to `{new_name}` with priority `{priority}`',
+        'log_user_added': '{actor} added user {user} to group `{group}`',
+        'log_user_removed': '{actor} removed user {user} from all groups',
+        'log_user_moved': '{actor} moved user {user} to `{group}`',
+        'log_group_list_updated': '{actor} updated group list channel',
+        'log_access_granted': '{actor} set access to {role}',
+        'log_access_removed': '{actor} removed access from {role}',
+        'log_entries_dropped': '*{count} log entries were dropped*',
+        'bulk_no_input': 'Paste a list of users or attach a text file.',
+        'bulk_file_too_large': 'The file is too large, the limit is {limit} KB.',
+        'bulk_file_unreadable': 'The file is not UTF-8 text.',
+        'bulk_too_many': 'At most {limit} users can be changed at once, got {count}.',
+        'bulk_users_added': 'Added {count} users to group `{group}`.',
+        'bulk_users_moved': 'Moved {count} users to group `{group}`.',
+        'bulk_users_removed': 'Removed {count} users from all groups.',
+        'bulk_skipped': 'Skipped {count}:\n{entries}',
+        'bulk_skipped_entry': 'entry {line}: {reason}',
+        'bulk_skipped_more': '…and {count} more',
+        'bulk_error_format': 'expected `@user, steam name, steam profile`',
+        'bulk_error_unknown_user': 'user `{user}` is not on this server',
+        'bulk_error_not_in_group': '<@{user}> is not in any group',
+        'log_users_added': '{actor} added {count} users to group `{group}`: {users}',
+        'log_users_moved': '{actor} moved {count} users to `{group}`: {users}',
+        'log_users_removed': '{actor} removed {count} users from all groups: {users}',
+        'import_running': 'An import is already running on this server.',
+        'import_too_large': 'The file is too large, the limit is {limit} MB.',
+        'import_too_many_rows': 'At most {limit} rows can be imported at once.',
+        'import_download_failed': 'Could not download the file, try again.',
+        'import_bad_header': 'The CSV header has to name the columns {columns}.',
+        'import_bad_json': 'The file is not a roster export or a JSON list of users.',
+        'import_unterminated_quote': 'The quoted field starting on line {line} is never closed.',
+        'import_progress': 'Importing… {rows} rows read, {errors} skipped.',
+        'import_done': 'Imported {count} users, created {groups} groups.',
+        'import_error_record': 'not a user record',
+        'import_error_group': 'group name is missing or longer than {limit} characters',
+        'import_error_priority': 'priority `{value}` is not a number',
+        'import_error_priority_conflict': 'group `{group}` already has priority {priority}',
+        'import_error_user': 'expected a user mention or id',
+        'import_error_steam_name': 'steam name is missing or longer than {limit} characters',
+        'import_error_steam_profile': 'steam profile is missing or not a link',
+        'log_roster_imported': '{actor} imported {count} users, {groups} new groups',
+    },
+    'ru': {
+        'database_sent': 'Отправил файл базы данных в личные сообщения.',
+        'export_sent': 'Отправил выгрузку списка в личные сообщения.',
+        'export_too_large': 'Выгрузка занимает {size} МБ, это больше ограничения на вложения в {limit} МБ.',
+        'dm_forbidden': 'Не могу отправить Вам приватное сообщение. Проверьте настройки приватности.',
+        'no_permission': 'У вас нет прав на использование данной команды.',
+        'commands_synced': 'Команды синхронизированы',
+        'display_channel_set': 'Канал отображения установлен в {channel}',
+        'group_exists': 'Группа `{group}` уже существует!',
+        'group_not_found': 'Группа с идентификатором `{group_id}` не существует!',
+        'group_created': 'Группа `{group}` создана!',
+        'group_deleted': 'Группа `{group}` удалена!',
+        'group_renamed': 'Группа `{group}` переименована в `{new_name}`!',
+        'group_list': 'Список групп:\n{groups}',
+        'group_list_entry': '**{id}.** `{name}` : *приоритет = `{priority}`*',
+        'no_groups': 'Группы не найдены.',
+        'group_list_updated': 'Список участников обновлён!',
+        'user_added': 'Пользователь `{user}` добавлен в группу `{group}`!',
+        'user_removed': 'Пользователь `{user}` удалён из всех групп!',
+        'user_moved': 'Пользователь `{user}` перемещён в группу `{group}`!',
+        'access_granted': '`{role}` теперь имеет доступ к командам бота',
+        'access_already_granted': '`{role}` уже имеет доступ к командам бота',
+        'access_removed': '`{role}` права на использование команд бота были отозваны',
+        'access_not_granted': '`{role}` не имел прав на использование команд бота',
+        'allowed_roles': 'Роли, имеющие доступ к командам бота:\n{roles}',
+        'no_allowed_roles': 'На этом сервере нет ролей, которым был бы разрешён доступ к командам бота',
+        'log_display_channel_set': '{actor} установил канал для отображения списка в {channel}.',
+        'log_display_and_logging_channel_set': '{actor} установил канал для отображения списка в {channel}. '
+                                               'Канал для логов теперь в {logging_channel}',
+        'log_group_created': '{actor} создал группу `{group}` с приоритетом `{priority}`',
+        'log_group_deleted': '{actor} удалил группу `{group}`',
+        'log_group_renamed': '{actor} переименовал группу `{group}` в `{new_name}` с приоритетом `{priority}`',
+        'log_user_added': '{actor} добавил пользователя {user} в группу `{group}`',
+        'log_user_removed': '{actor} удалил пользователя {user} из всех групп',
+        'log_user_moved': '{actor} переместил пользователя {user} в `{group}`',
+        'log_group_list_updated': '{actor} обновил канал с группами',
+        'log_access_granted': '{actor} добавил доступ к боту для {role}',
+        'log_access_removed': '{actor} удалил доступ к боту у {role}',
+        'log_entries_dropped': '*Пропущено записей журнала: {count}*',
+        'bulk_no_input': 'Вставьте список пользователей или приложите текстовый файл.',
+        'bulk_file_too_large': 'Файл слишком большой, ограничение {limit} КБ.',
+        'bulk_file_unreadable': 'Файл не является текстом в кодировке UTF-8.',
+        'bulk_too_many': 'За раз можно изменить не более {limit} пользователей, получено {count}.',
+        'bulk_users_added': 'Добавлено пользователей в группу `{group}`: {count}.',
+        'bulk_users_moved': 'Перемещено пользователей в группу `{group}`: {count}.',
+        'bulk_users_removed': 'Удалено пользователей из всех групп: {count}.',
+        'bulk_skipped': 'Пропущено {count}:\n{entries}',
+        'bulk_skipped_entry': 'запись {line}: {reason}',
+        'bulk_skipped_more': '…и ещё {count}',
+        'bulk_error_format': 'ожидается `@пользователь, имя в стиме, ссылка на стим`',
+        'bulk_error_unknown_user': 'пользователя `{user}` нет на этом сервере',
+        'bulk_error_not_in_group': '<@{user}> не состоит ни в одной группе',
+        'log_users_added': '{actor} добавил {count} пользователей в группу `{group}`: {users}',
+        'log_users_moved': '{actor} переместил {count} пользователей в `{group}`: {users}',
+        'log_users_removed': '{actor} удалил {count} пользователей из всех групп: {users}',
+        'import_running': 'На этом сервере уже идёт импорт.',
+        'import_too_large': 'Файл слишком большой, ограничение {limit} МБ.',
+        'import_too_many_rows': 'За раз можно импортировать не более {limit} строк.',
+        'import_download_failed': 'Не удалось скачать файл, попробуйте ещё раз.',
+        'import_bad_header': 'В заголовке CSV должны быть столбцы {columns}.',
+        'import_bad_json': 'Файл не является выгрузкой списка или JSON списком пользователей.',
+        'import_unterminated_quote': 'Поле в кавычках, начатое в строке {line}, не закрыто.',
+        'import_progress': 'Импорт… прочитано строк: {rows}, пропущено: {errors}.',
+        'import_done': 'Импортировано пользователей: {count}, создано групп: {groups}.',
+        'import_error_record': 'это не запись пользователя',
+        'import_error_group': 'название группы пустое или длиннее {limit} символов',
+        'import_error_priority': 'приоритет `{value}` не является числом',
+        'import_error_priority_conflict': 'у группы `{group}` уже указан приоритет {priority}',
+        'import_error_user': 'ожидается упоминание или идентификатор пользователя',
+        'import_error_steam_name': 'имя в стиме пустое или длиннее {limit} символов',
+        'import_error_steam_profile': 'ссылка на стим отсутствует или не является ссылкой',
+        'log_roster_imported': '{actor} импортировал пользователей: {count}, новых групп: {groups}',
+    },
+}
+
+LOCALES: Dict[discord.Locale, str] = {
+    discord.Locale.russian: 'ru',
+}
+
+# Slash command names, descriptions and parameters, keyed by the English string
+COMMANDS: Dict[discord.Locale, Dict[str, str]] = {
+    discord.Locale.russian: {
+        'sync': 'синхронизация',
+        'Owner only': 'Только для владельца сервера',
+        'list_groups': 'список_групп',
+        'priority': 'приоритет',
+        'move_user': 'переместить_пользователя',
+        'Move a user to a different group': 'Переместить пользователя в другую группу',
+        'user': 'пользователь',
+        'new_group_id': 'новая_группа',
+        'List all existing groups': 'Список всех существующих групп',
+        'group_id': 'группа',
+        'steam_name': 'имя_в_стиме',
+        'steam_profile': 'ссылка_на_стим',
+        'group_name': 'название_группы',
+        'display_channel': 'канал_для_списка',
+        'logging_channel': 'канал_для_логов',
+        'role': 'роль',
+        'new_name': 'новое_название',
+        'remove_user': 'удалить_пользователя',
+        'Remove a user from all groups': 'Удалить пользователя из всех групп',
+        'add_user': 'добавить_пользователя',
+        'Add a user to a group': 'Добавить пользователя в группу',
+        'rename_group': 'изменить_группу',
+        'Rename an existing group': 'Изменить название и приоритет существующей группы',
+        'delete_group': 'удалить_группу',
+        'Delete an existing group': 'Удалить существующую группу',
+        'create_group': 'создать_группу',
+        'Create a new group': 'Создать новую группу',
+        'set_display_channel': 'установить_канал',
+        'Set the channel to display the group list':
+            'Установить канал, в котором будет отображаться и обновляться список участников всех групп',
+        'update_list': 'обновить_список',
+        'Update group list in chanel': 'Обновить список участников в закреплённом канале',
+        'list_permissions': 'список_разрешённых',
+        'Get roles list have access to bot commands': 'Показать список ролей, которым разрешён доступ к командам',
+        'remove_permissions': 'запретить_доступ',
+        "Remove the role's access to bot commands": 'Запретить доступ к командам бота для роли',
+        'set_permissions': 'разрешить_доступ',
+        'Set roles that will have access to bot commands': 'Разрешить доступ к командам бота для роли',
+        'load_data': 'скачать_базу_данных',
+        'Load data file': 'Скачать файл базы данных с актуальными данными',
+        'format': 'формат',
+        'SQLite database of this server, or the roster as JSON or CSV':
+            'База данных SQLite этого сервера или список участников в JSON или CSV',
+        'logging_chat': 'канал_для_логов',
+        'metrics': 'метрики',
+        'bulk_add_users': 'добавить_пользователей',
+        'Add many users to a group at once': 'Добавить сразу несколько пользователей в группу',
+        'bulk_move_users': 'переместить_пользователей',
+        'Move many users to a group at once': 'Переместить сразу несколько пользователей в группу',
+        'bulk_remove_users': 'удалить_пользователей',
+        'Remove many users from all groups at once': 'Удалить сразу несколько пользователей из всех групп',
+        'users': 'пользователи',
+        'file': 'файл',
+        '@user, steam name, steam profile; separated by semicolons': '@пользователь, имя в стиме, ссылка на стим; через точку с запятой',
+        'Text or CSV file with one user per line': 'Текстовый или CSV файл, один пользователь на строку',
+        'User mentions or ids': 'Упоминания или идентификаторы пользователей',
+        'Show bot performance metrics': 'Показать метрики производительности бота',
+        'import_roster': 'импортировать_список',
+        'Import groups and users from a CSV or JSON file': 'Импортировать группы и пользователей из CSV или JSON файла',
+        'CSV or JSON roster, as produced by /load_data, optionally gzip compressed':
+            'Список в CSV или JSON, как его выгружает /скачать_базу_данных, можно сжатый gzip',
+    },
+}
+
+
+def _compile(language: str) -> Dict[str, Callable[..., str]]:
+    templates = dict(MESSAGES['en'])
+    templates.update(MESSAGES[language])
+    return {message_id: template.format for message_id, template in templates.items()}
+
+
+# Bound str.format of every template, so a lookup is one dict access and one format call
+_TEMPLATES: Dict[str, Dict[str, Callable[..., str]]] = {language: _compile(language) for language in MESSAGES}
+
+
+def text(locale: Optional[discord.Locale], message_id: str, **kwargs) -> str:
+    return _TEMPLATES[LOCALES.get(locale, 'en')][message_id](**kwargs)
+
+
+class Translator(app_commands.Translator):
+    async def translate(
+            self,
+            string: app_commands.locale_str,
+            locale: discord.Locale,
+            context: app_commands.TranslationContext,
+    ) -> str | None:
+        translations = COMMANDS.get(locale)
+        if translations is None:
+            return None
+        return translations.get(str(string))
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import codecs
+import csv
+import json
+import re
+import uuid
+import zlib
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import aiohttp
+
+import bulk
+import database
+
+# Rows written to the staging table per transaction
+CHUNK_ROWS = 500
+MAX_FILE_SIZE = 5 * 1024 * 1024
+MAX_ROWS = 10000
+MAX_GROUP_NAME = 100
+MAX_FIELD = 200
+
+REQUIRED_COLUMNS = ('group', 'discord_id', 'steam_name', 'steam_profile')
+
+_USER = re.compile(r'^(?:<@!?(\d+)>|(\d{1,20}))$')
+
+
+class ImportRow(NamedTuple):
+    line: int
+    group: str
+    priority: Optional[int]
+    discord_id: int
+    discord_name: Optional[str]
+    steam_name: str
+    steam_profile: str
+
+
+class ImportAborted(Exception):
+    """The file as a whole cannot be imported; ``message_id`` and ``kwargs`` are for i18n.text."""
+
+    def __init__(self, message_id: str, **kwargs):
+        super().__init__(message_id)
+        self.message_id = message_id
+        self.kwargs = kwargs
+
+
+async def stream_text(url: str, gzipped: bool = False) -> AsyncIterator[str]:
+    """Download ``url`` and yield its text as it arrives, refusing anything over the size limit."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    # 16 + MAX_WBITS makes zlib expect a gzip header
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    received = 0
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                if decompressor is not None:
+                    try:
+                        chunk = decompressor.decompress(chunk, MAX_FILE_SIZE + 1 - received)
+                    except zlib.error:
+                        raise ImportAborted('bulk_file_unreadable')
+                received += len(chunk)
+                if received > MAX_FILE_SIZE:
+                    raise ImportAborted('import_too_large', limit=MAX_FILE_SIZE // 2 ** 20)
+                try:
+                    yield decoder.decode(chunk)
+                except UnicodeDecodeError:
+                    raise ImportAborted('bulk_file_unreadable')
+    try:
+        yield decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        raise ImportAborted('bulk_file_unreadable')
+
+
+async def csv_records(chunks: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Dict[str, str]]]:
+    """Yield ``(line, record)`` for every CSV row, keyed by the lower-cased header."""
+    header: Optional[List[str]] = None
+    pending: List[str] = []
+    line = 0
+
+    def parse(text: str) -> Optional[Dict[str, str]]:
+        nonlocal header
+        row = next(csv.reader([text], skipinitialspace=True), [])
+        if not any(field.strip() for field in row):
+            return None
+        if header is None:
+            header = [field.strip().lower() for field in row]
+            if any(column not in header for column in REQUIRED_COLUMNS):
+                raise ImportAborted('import_bad_header', columns=', '.join(REQUIRED_COLUMNS))
+            return None
+        return dict(zip(header, row))
+
+    def feed(text: str) -> Optional[Tuple[int, Dict[str, str]]]:
+        nonlocal line
+        line += 1
+        pending.append(text.rstrip('\r'))
+        record_text = '\n'.join(pending)
+        # A quoted field may span lines, the record ends once its quotes are balanced
+        if record_text.count('"') % 2:
+            return None
+        start = line - len(pending) + 1
+        pending.clear()
+        record = parse(record_text)
+        return (start, record) if record is not None else None
+
+    buffer = ''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split('\n')
+        for text in lines:
+            result = feed(text)
+            if result is not None:
+                yield result
+    if buffer:
+        result = feed(buffer)
+        if result is not None:
+            yield result
+    if pending:
+        raise ImportAborted('import_unterminated_quote', line=line - len(pending) + 1)
+
+
+async def json_records(chunks: AsyncIterator[str]) -> AsyncIterator[Tuple[int, object]]:
+    """Accepts the JSON roster export, or a flat list of records; numbers records from 1.
+
+    JSON has no record boundaries to stream on, so it is parsed once the capped download is complete.
+    """
+    text = ''.join([chunk async for chunk in chunks])
+    try:
+        data = json.loads(text)
+    except ValueError:
+        raise ImportAborted('import_bad_json')
+
+    if isinstance(data, dict) and isinstance(data.get('groups'), list):
+        records = []
+        for group in data['groups']:
+            if not isinstance(group, dict):
+                raise ImportAborted('import_bad_json')
+            for member in group.get('members') or []:
+                records.append({**member, 'group': group.get('name'), 'priority': group.get('priority')}
+                               if isinstance(member, dict) else member)
+    elif isinstance(data, list):
+        records = data
+    else:
+        raise ImportAborted('import_bad_json')
+    for item in enumerate(records, start=1):
+        yield item
+
+
+def _text(record: Dict[str, object], key: str) -> str:
+    value = record.get(key)
+    return '' if value is None else str(value).strip()
+
+
+def validate(line: int, record: object) -> Union[ImportRow, bulk.BulkError]:
+    if not isinstance(record, dict):
+        return bulk.BulkError(line, 'import_error_record', {})
+
+    group = _text(record, 'group')
+    if not group or len(group) > MAX_GROUP_NAME or '\n' in group:
+        return bulk.BulkError(line, 'import_error_group', {'limit': MAX_GROUP_NAME})
+
+    priority = _text(record, 'priority')
+    try:
+        priority = int(priority) if priority else None
+    except ValueError:
+        return bulk.BulkError(line, 'import_error_priority', {'value': priority[:20]})
+
+    match = _USER.match(_text(record, 'discord_id'))
+    if match is None:
+        return bulk.BulkError(line, 'import_error_user', {})
+
+    steam_name = _text(record, 'steam_name')
+    if not steam_name or len(steam_name) > MAX_FIELD:
+        return bulk.BulkError(line, 'import_error_steam_name', {'limit': MAX_FIELD})
+
+    steam_profile = _text(record, 'steam_profile')
+    if not steam_profile or len(steam_profile) > MAX_FIELD or any(c.isspace() for c in steam_profile):
+        return bulk.BulkError(line, 'import_error_steam_profile', {})
+    if '://' in steam_profile:
+        url = urlparse(steam_profile)
+        if url.scheme not in ('http', 'https') or not url.netloc:
+            return bulk.BulkError(line, 'import_error_steam_profile', {})
+
+    return ImportRow(line, group, priority, int(match.group(1) or match.group(2)),
+                     _text(record, 'discord_name')[:MAX_FIELD] or None, steam_name, steam_profile)
+
+
+class Staging:
+    """Validated rows of one import, parked in a temporary table until they are merged in one transaction.
+
+    The table lives on the database connection only, so an aborted import or a crash leaves nothing behind.
+    """
+
+    def __init__(self, db: database.Database, guild_id: int):
+        self.db = db
+        self.guild_id = guild_id
+        self.import_id = uuid.uuid4().hex
+        self.rows = 0
+
+    async def add(self, rows: List[ImportRow]):
+        def stage(cursor):
+            cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS import_rows (
+                    import_id TEXT NOT NULL,
+                    guild_id INTEGER NOT NULL,
+                    line INTEGER NOT NULL,
+                    group_name TEXT NOT NULL,
+                    priority INTEGER,
+                    discord_id INTEGER NOT NULL,
+                    discord_name TEXT NOT NULL,
+                    steam_name TEXT NOT NULL,
+                    steam_profile TEXT NOT NULL,
+                    PRIMARY KEY (import_id, discord_id)
+                )
+            ''')
+            # A later row for the same user replaces the earlier one
+            cursor.executemany('''
+                INSERT OR REPLACE INTO temp.import_rows
+                    (import_id, guild_id, line, group_name, priority, discord_id, discord_name, steam_name,
+                     steam_profile)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(self.import_id, self.guild_id, row.line, row.group, row.priority, row.discord_id,
+                   row.discord_name, row.steam_name, row.steam_profile) for row in rows])
+
+        await self.db.transaction(stage)
+        self.rows += len(rows)
+
+    async def discard(self):
+        if self.rows:
+            await self.db.execute('DELETE FROM temp.import_rows WHERE import_id = ?', (self.import_id,))
+            self.rows = 0
+
+
+async def stage_records(records: AsyncIterator[Tuple[int, object]], staging: Staging,
+                        resolve: Callable[[List[int]], Awaitable[Dict[int, str]]],
+                        progress: Callable[[int, int], Awaitable[None]]) -> List[bulk.BulkError]:
+    """Validate records and stage them in chunks; returns the rejected rows.
+
+    Users without a ``discord_name`` column get their current name through ``resolve``, one call per chunk.
+    """
+    errors = []
+    priorities: Dict[str, Optional[int]] = {}
+    chunk: List[ImportRow] = []
+    seen = 0
+
+    async def flush():
+        names = await resolve([row.discord_id for row in chunk if row.discord_name is None])
+        rows = []
+        for row in chunk:
+            if row.discord_name is None:
+                if row.discord_id not in names:
+                    errors.append(bulk.BulkError(row.line, 'bulk_error_unknown_user', {'user': row.discord_id}))
+                    continue
+                row = row._replace(discord_name=names[row.discord_id])
+            rows.append(row)
+        if rows:
+            await staging.add(rows)
+        chunk.clear()
+        await progress(seen, len(errors))
+
+    async for line, record in records:
+        seen += 1
+        if seen > MAX_ROWS:
+            raise ImportAborted('import_too_many_rows', limit=MAX_ROWS)
+        row = validate(line, record)
+        if isinstance(row, bulk.BulkError):
+            errors.append(row)
+            continue
+
+        # Every row of a group has to agree on its priority, rows may leave it out
+        known = priorities.get(row.group)
+        if row.priority is not None and known is not None and row.priority != known:
+            errors.append(bulk.BulkError(line, 'import_error_priority_conflict',
+                                         {'group': row.group, 'priority': known}))
+            continue
+        if known is None:
+            priorities[row.group] = row.priority
+
+        chunk.append(row)
+        if len(chunk) >= CHUNK_ROWS:
+            await flush()
+    if chunk:
+        await flush()
+    return errors
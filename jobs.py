@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional
+
+import database
+import metrics
+
+logger = logging.getLogger('discord')
+
+# Backoff of a failed render, doubled per attempt up to the maximum
+RETRY_DELAY = 5.0
+RETRY_MAX_DELAY = 300.0
+
+
+class RenderJob(NamedTuple):
+    guild_id: int
+    force: bool
+    generation: int
+    attempts: int
+
+
+class RenderQueue:
+    """Durable render jobs in SQLite, at most one per guild.
+
+    Marking a guild dirty upserts its job: every mutation pushes ``due_at`` out by ``quiet_window``, but never
+    past ``max_delay`` after the first mutation since the job was last claimed. Workers claim due jobs with a
+    lease. A job whose worker died is claimed again once the lease ran out and rendered from the channel
+    history, which picks up whatever the dead worker already sent or edited.
+    """
+
+    def __init__(self, db: database.Database, quiet_window: float, max_delay: float, lease: float = 120.0):
+        self.db = db
+        self.quiet_window = quiet_window
+        self.max_delay = max_delay
+        self.lease = lease
+        self._marks: Dict[int, bool] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def mark_dirty(self, guild_id: int, force: bool = False):
+        """Queues a render; marks made while a write is in flight go out together in the next one."""
+        self._marks[guild_id] = self._marks.get(guild_id, False) or force
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        while self._marks:
+            marks, self._marks = self._marks, {}
+            try:
+                await self.enqueue(marks)
+            except Exception:
+                logger.exception(f'Could not queue renders of {len(marks)} guilds, retrying')
+                for guild_id, force in marks.items():
+                    self._marks[guild_id] = self._marks.get(guild_id, False) or force
+                await asyncio.sleep(1.0)
+
+    async def enqueue(self, marks: Dict[int, bool]):
+        now = time.time()
+        await self.db.transaction(lambda cursor: cursor.executemany('''
+            INSERT INTO render_jobs (guild_id, force, first_marked, due_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (guild_id) DO UPDATE SET
+                force = force OR excluded.force,
+                first_marked = COALESCE(first_marked, excluded.first_marked),
+                due_at = MIN(excluded.due_at, COALESCE(first_marked, excluded.first_marked) + ?),
+                generation = generation + 1
+        ''', [(guild_id, int(force), now, now + self.quiet_window, self.max_delay)
+              for guild_id, force in marks.items()]))
+
+    async def next_due(self) -> Optional[float]:
+        """When the next job can be claimed, None if the queue is empty."""
+        row = await self.db.fetchone('''
+            SELECT MIN(CASE WHEN claimed_by IS NULL THEN due_at ELSE MAX(due_at, claimed_until) END)
+            FROM render_jobs
+        ''')
+        return row[0]
+
+    async def claim(self, worker_id: str) -> Optional[RenderJob]:
+        now = time.time()
+
+        def claim(cursor):
+            row = cursor.execute('''
+                SELECT guild_id, force, generation, attempts, claimed_by FROM render_jobs
+                WHERE due_at <= ? AND (claimed_by IS NULL OR claimed_until < ?)
+                ORDER BY due_at LIMIT 1
+            ''', (now, now)).fetchone()
+            if row is None:
+                return None
+            guild_id, force, generation, attempts, claimed_by = row
+            cursor.execute('''
+                UPDATE render_jobs SET claimed_by = ?, claimed_until = ?, force = 0, first_marked = NULL
+                WHERE guild_id = ?
+            ''', (worker_id, now + self.lease, guild_id))
+            # The previous worker let its lease run out and may have stopped half way through the render
+            return RenderJob(guild_id, bool(force) or claimed_by is not None, generation, attempts)
+
+        return await self.db.transaction(claim)
+
+    async def renew(self, job: RenderJob, worker_id: str):
+        await self.db.execute('UPDATE render_jobs SET claimed_until = ? WHERE guild_id = ? AND claimed_by = ?',
+                              (time.time() + self.lease, job.guild_id, worker_id))
+
+    async def complete(self, job: RenderJob, worker_id: str):
+        def complete(cursor):
+            deleted = cursor.execute('DELETE FROM render_jobs WHERE guild_id = ? AND claimed_by = ? AND generation = ?',
+                                     (job.guild_id, worker_id, job.generation)).rowcount
+            if not deleted:
+                # Marked again while rendering, stays queued for another render
+                cursor.execute('''
+                    UPDATE render_jobs SET claimed_by = NULL, claimed_until = NULL, attempts = 0
+                    WHERE guild_id = ? AND claimed_by = ?
+                ''', (job.guild_id, worker_id))
+
+        await self.db.transaction(complete)
+
+    async def retry(self, job: RenderJob, worker_id: str):
+        delay = min(RETRY_MAX_DELAY, RETRY_DELAY * 2 ** job.attempts)
+        await self.db.execute('''
+            UPDATE render_jobs SET claimed_by = NULL, claimed_until = NULL, attempts = attempts + 1,
+                force = force OR ?, due_at = MAX(due_at, ?)
+            WHERE guild_id = ? AND claimed_by = ?
+        ''', (int(job.force), time.time() + delay, job.guild_id, worker_id))
+
+
+class RenderWorker:
+    """Claims due render jobs and runs up to ``concurrency`` renders at a time.
+
+    Several workers, in one or more processes, can share a queue; a guild is only ever claimed by one of them.
+    """
+
+    def __init__(self, queue: RenderQueue, render: Callable[[int, bool], Awaitable[None]], worker_id: str,
+                 concurrency: int = 2, poll_interval: float = 0.5):
+        self.queue = queue
+        self._render = render
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+
+    async def run(self):
+        await asyncio.gather(*(self._consume() for _ in range(self.concurrency)))
+
+    async def _consume(self):
+        while True:
+            try:
+                # Only due jobs are claimed, so idle polling stays a read and never takes the write lock
+                due = await self.queue.next_due()
+                wait = self.poll_interval if due is None else due - time.time()
+                if wait > 0:
+                    await asyncio.sleep(min(wait, self.poll_interval))
+                    continue
+
+                job = await self.queue.claim(self.worker_id)
+                if job is not None:
+                    await self.process(job)
+            except Exception:
+                logger.exception('Render worker could not reach the job queue')
+                await asyncio.sleep(self.poll_interval)
+
+    async def process(self, job: RenderJob):
+        renewal = asyncio.create_task(self._renew(job))
+        try:
+            await self._render(job.guild_id, job.force)
+        except Exception:
+            logger.exception(f'Error while updating display channel of guild {job.guild_id}, retrying later')
+            failed = True
+        else:
+            failed = False
+        finally:
+            renewal.cancel()
+
+        metrics.registry.inc('render_jobs_total', result='retry' if failed else 'ok')
+        if failed:
+            await self.queue.retry(job, self.worker_id)
+        else:
+            await self.queue.complete(job, self.worker_id)
+
+    async def _renew(self, job: RenderJob):
+        # Renders paced by the outbound scheduler can outlast the lease
+        while True:
+            await asyncio.sleep(self.queue.lease / 3)
+            await self.queue.renew(job, self.worker_id)
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import discord
+
+import metrics
+
+logger = logging.getLogger('discord')
+
+# Gateway member requests accept at most 100 user ids
+CHUNK_SIZE = 100
+
+
+def mention(discord_id: int) -> str:
+    return f'<@{discord_id}>'
+
+
+class UserCache:
+    """Bounded LRU cache of users that expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int = 2048, ttl: float = 900.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._users: OrderedDict[int, Tuple[float, discord.abc.User]] = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[discord.abc.User]:
+        entry = self._users.get(user_id)
+        if entry is None:
+            metrics.registry.inc('cache_requests_total', cache='users', result='miss')
+            return None
+        stored_at, user = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._users[user_id]
+            metrics.registry.inc('cache_requests_total', cache='users', result='expired')
+            return None
+        self._users.move_to_end(user_id)
+        metrics.registry.inc('cache_requests_total', cache='users', result='hit')
+        return user
+
+    def put(self, user: discord.abc.User):
+        self._users[user.id] = (time.monotonic(), user)
+        self._users.move_to_end(user.id)
+        while len(self._users) > self.maxsize:
+            self._users.popitem(last=False)
+
+    def discard(self, user_id: int):
+        self._users.pop(user_id, None)
+
+
+class MemberResolver:
+    """Resolves stored discord ids to user objects without per-user REST calls.
+
+    Lookups go to the gateway cache first, then to the local LRU cache, and whatever is left is requested
+    from the gateway in chunks of up to 100 ids.
+    """
+
+    def __init__(self, client: discord.Client, cache: UserCache):
+        self.client = client
+        self.cache = cache
+
+    def remember(self, user: discord.abc.User):
+        """Keeps a user that arrived with an interaction, so later lookups of the id need no request."""
+        self.cache.put(user)
+
+    def get(self, guild: Optional[discord.Guild], user_id: int) -> Optional[discord.abc.User]:
+        user = guild.get_member(user_id) if guild is not None else None
+        if user is None:
+            user = self.cache.get(user_id)
+        if user is None:
+            user = self.client.get_user(user_id)
+        return user
+
+    async def resolve(self, guild: Optional[discord.Guild], user_ids: Iterable[int]) -> Dict[int, discord.abc.User]:
+        resolved = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            user = self.get(guild, user_id)
+            if user is None:
+                missing.append(user_id)
+            else:
+                resolved[user_id] = user
+
+        if guild is None or not missing:
+            return resolved
+
+        for start in range(0, len(missing), CHUNK_SIZE):
+            found = await self._query(guild, missing[start:start + CHUNK_SIZE])
+            if found is None:
+                break
+            for member in found:
+                resolved[member.id] = member
+
+        return resolved
+
+    async def fetch_members(self, guild: discord.Guild, user_ids: Iterable[int]) -> Optional[Dict[int, discord.Member]]:
+        """The users that are currently members of the guild, or None if the gateway could not tell."""
+        present = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            member = guild.get_member(user_id)
+            if member is None:
+                missing.append(user_id)
+            else:
+                present[user_id] = member
+
+        for start in range(0, len(missing), CHUNK_SIZE):
+            found = await self._query(guild, missing[start:start + CHUNK_SIZE])
+            if found is None:
+                return None
+            for member in found:
+                present[member.id] = member
+        return present
+
+    async def _query(self, guild: discord.Guild, user_ids: List[int]) -> Optional[List[discord.Member]]:
+        try:
+            with metrics.registry.timer('member_request_seconds'):
+                found = await guild.query_members(user_ids=user_ids, limit=len(user_ids))
+        except (asyncio.TimeoutError, discord.ClientException) as e:
+            logger.warning(f'Could not request members of guild {guild.id}: {e}')
+            return None
+        for member in found:
+            self.cache.put(member)
+        return found
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import bisect
+import functools
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger('discord')
+
+# Upper bounds in seconds, shared by every latency histogram
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile, the largest bound if it is past the last one."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class Metrics:
+    """In-process counters and histograms, rendered in the Prometheus text format.
+
+    Safe to update from the database thread as well as the event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._help: Dict[str, str] = {}
+        self.started = time.time()
+
+    def describe(self, name: str, help: str, buckets: Optional[Tuple[float, ...]] = None):
+        self._help[name] = help
+        if buckets is not None:
+            self._buckets[name] = buckets
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self._buckets.get(name, LATENCY_BUCKETS))
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counters(self, name: str) -> Dict[Labels, float]:
+        with self._lock:
+            return dict(self._counters.get(name, {}))
+
+    def histograms(self, name: str) -> Dict[Labels, Histogram]:
+        with self._lock:
+            return dict(self._histograms.get(name, {}))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} counter')
+                for labels, value in sorted(series.items()):
+                    lines.append(f'{name}{_format_labels(labels)} {value:g}')
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(labels, ("le", f"{bound:g}"))} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(labels, ("le", "+Inf"))} {histogram.count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum:g}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Metrics()
+registry.describe('command_seconds', 'Slash command handling time')
+registry.describe('db_query_seconds', 'Time a statement or transaction ran on the database thread')
+registry.describe('db_wait_seconds', 'Time a database job waited for the database thread')
+registry.describe('rest_requests_total', 'Channel operations sent by the outbound scheduler, by route')
+registry.describe('rest_seconds', 'Duration of channel operations, including library retries')
+registry.describe('rest_queue_seconds', 'Time channel operations waited in the outbound scheduler')
+registry.describe('rest_errors_total', 'Channel operations that raised, by route and exception type')
+registry.describe('rest_rate_limited_total', 'HTTP 429 responses seen by discord.py')
+registry.describe('rest_rate_limited_seconds_total', 'Time discord.py slept on 429 responses')
+registry.describe('member_request_seconds', 'Duration of gateway member requests')
+registry.describe('render_seconds', 'Display channel render time')
+registry.describe('render_jobs_total', 'Queued render jobs finished by a render worker, by result')
+registry.describe('render_wait_seconds', 'Time a due render waited for a free render worker of its shard')
+registry.describe('render_reconciles_total', 'Renders that had to read the channel history')
+registry.describe('render_messages_touched', 'Messages sent, edited or deleted by one render', SIZE_BUCKETS)
+registry.describe('cache_requests_total', 'Cache lookups by result')
+
+_STATEMENT_SPACE = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=512)
+def statement_label(sql: str) -> str:
+    """Short, stable label of a SQL statement, so every call site gets its own series."""
+    return _STATEMENT_SPACE.sub(' ', sql).strip()[:60]
+
+
+_ROUTE_IDS = re.compile(r'/\d+')
+
+
+class RateLimitHandler(logging.Handler):
+    """Counts the 429 responses discord.py retries internally, by route.
+
+    The library only reports them through its log, so this handler listens to the ``discord.http`` logger.
+    """
+
+    def emit(self, record: logging.LogRecord):
+        message = record.msg if isinstance(record.msg, str) else ''
+        if 'responded with 429' not in message or not isinstance(record.args, tuple) or len(record.args) < 3:
+            return
+        method, url, retry_after = record.args[:3]
+        # https://discord.com/api/v10/channels/123/messages -> /channels/:id/messages
+        path = '/' + str(url).split('/api/v', 1)[-1].split('/', 1)[-1]
+        route = f'{method} {_ROUTE_IDS.sub("/:id", path)}'
+        registry.inc('rest_rate_limited_total', route=route)
+        registry.inc('rest_rate_limited_seconds_total', retry_after, route=route)
+
+
+def summary(limit: int = 1900) -> str:
+    """Human readable digest for the admin command."""
+    lines = [f'uptime: {time.time() - registry.started:.0f}s']
+
+    def histograms(title: str, name: str):
+        series = registry.histograms(name)
+        if not series:
+            return
+        lines.append(f'**{title}**')
+        for labels, histogram in sorted(series.items(), key=lambda item: -item[1].sum):
+            label = ' '.join(value for _, value in labels) or '-'
+            lines.append(f'`{label}` n={histogram.count} avg={histogram.sum / histogram.count * 1000:.1f}ms '
+                         f'p95<={histogram.quantile(0.95) * 1000:g}ms')
+
+    histograms('commands', 'command_seconds')
+    histograms('database', 'db_query_seconds')
+    histograms('outbound queue', 'rest_queue_seconds')
+    histograms('rest', 'rest_seconds')
+    histograms('render', 'render_seconds')
+
+    touched = registry.histograms('render_messages_touched')
+    if touched:
+        renders = sum(histogram.count for histogram in touched.values())
+        total = sum(histogram.sum for histogram in touched.values())
+        lines.append(f'**renders** n={renders} messages touched avg={total / renders:.1f}')
+
+    requests = registry.counters('rest_requests_total')
+    if requests:
+        lines.append('**busiest routes**')
+        lines.extend(f'`{dict(labels)["op"]} {dict(labels)["channel"]}` {value:g}'
+                     for labels, value in sorted(requests.items(), key=lambda item: -item[1])[:5])
+
+    rate_limited = registry.counters('rest_rate_limited_total')
+    if rate_limited:
+        lines.append('**429**')
+        lines.extend(f'`{dict(labels)["route"]}` {value:g}' for labels, value in sorted(rate_limited.items()))
+
+    caches: Dict[str, List[float]] = {}
+    for labels, value in registry.counters('cache_requests_total').items():
+        labels = dict(labels)
+        caches.setdefault(labels['cache'], [0, 0])[labels['result'] != 'hit'] += value
+    if caches:
+        lines.append('**caches**')
+        lines.extend(f'`{cache}` hit ratio {hits / (hits + misses):.0%} of {hits + misses:g}'
+                     for cache, (hits, misses) in sorted(caches.items()))
+
+    text = '\n'.join(lines)
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+
+async def serve(host: str, port: int) -> web.AppRunner:
+    """Start the ``/metrics`` endpoint; keep the returned runner to shut it down."""
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f'Serving metrics on http://{host}:{port}/metrics')
+    return runner
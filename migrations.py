@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import logging
+import sqlite3
+
+logger = logging.getLogger('discord')
+
+
+# Every migration upgrades the schema by exactly one version. Databases created before versioning
+# report user_version 0 and go through all of them; the first one is a no-op for their existing tables.
+def _initial_schema(cursor: sqlite3.Cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            priority INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            discord_id INTEGER NOT NULL,
+            discord_name TEXT NOT NULL,
+            steam_name TEXT NOT NULL,
+            steam_profile TEXT NOT NULL,
+            group_id INTEGER,
+            FOREIGN KEY(group_id) REFERENCES groups(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            guild_id INTEGER PRIMARY KEY,
+            display_channel_id INTEGER,
+            logging_channel_id INTEGER
+        )
+    ''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS permissions (
+                      guild_id INTEGER,
+                      role_id INTEGER)''')
+
+
+def _indexes(cursor: sqlite3.Cursor):
+    # Old versions could leave several rows for one user, keep the most recent one
+    cursor.execute('''
+        DELETE FROM users
+        WHERE id NOT IN (SELECT MAX(id) FROM users GROUP BY discord_id)
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS users_discord_id ON users (discord_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS users_group_id ON users (group_id)')
+
+    # SQLite cannot add a primary key to an existing table, so permissions is rebuilt
+    cursor.execute('''
+        CREATE TABLE permissions_new (
+            guild_id INTEGER NOT NULL,
+            role_id INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, role_id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO permissions_new (guild_id, role_id)
+        SELECT guild_id, role_id FROM permissions
+        WHERE guild_id IS NOT NULL AND role_id IS NOT NULL
+    ''')
+    cursor.execute('DROP TABLE permissions')
+    cursor.execute('ALTER TABLE permissions_new RENAME TO permissions')
+
+
+def _guild_partitioning(cursor: sqlite3.Cursor):
+    # Rows created before partitioning can only be attributed when the bot was set up in a single guild
+    guilds = cursor.execute('SELECT guild_id FROM settings').fetchall()
+    legacy_guild_id = guilds[0][0] if len(guilds) == 1 else None
+    if legacy_guild_id is None and cursor.execute('SELECT 1 FROM groups LIMIT 1').fetchone():
+        logger.warning('Existing groups cannot be attributed to a single guild and are left without one')
+
+    cursor.execute('''
+        CREATE TABLE groups_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER,
+            name TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            UNIQUE (guild_id, name)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO groups_new (id, guild_id, name, priority)
+        SELECT id, ?, name, priority FROM groups
+    ''', (legacy_guild_id,))
+    cursor.execute('DROP TABLE groups')
+    cursor.execute('ALTER TABLE groups_new RENAME TO groups')
+
+    cursor.execute('''
+        CREATE TABLE users_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER,
+            discord_id INTEGER NOT NULL,
+            discord_name TEXT NOT NULL,
+            steam_name TEXT NOT NULL,
+            steam_profile TEXT NOT NULL,
+            group_id INTEGER,
+            FOREIGN KEY(group_id) REFERENCES groups(id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO users_new (id, guild_id, discord_id, discord_name, steam_name, steam_profile, group_id)
+        SELECT u.id, g.guild_id, u.discord_id, u.discord_name, u.steam_name, u.steam_profile, u.group_id
+        FROM users u
+        LEFT JOIN groups g ON g.id = u.group_id
+    ''')
+    cursor.execute('DROP TABLE users')
+    cursor.execute('ALTER TABLE users_new RENAME TO users')
+    cursor.execute('CREATE UNIQUE INDEX users_guild_discord_id ON users (guild_id, discord_id)')
+    cursor.execute('CREATE INDEX users_group_id ON users (group_id)')
+
+
+def _display_messages(cursor: sqlite3.Cursor):
+    cursor.execute('''
+        CREATE TABLE display_messages (
+            guild_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            file TEXT,
+            PRIMARY KEY (guild_id, position)
+        )
+    ''')
+
+
+def _bot_state(cursor: sqlite3.Cursor):
+    cursor.execute('''
+        CREATE TABLE bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+
+def _display_blocks(cursor: sqlite3.Cursor):
+    cursor.execute('ALTER TABLE display_messages ADD COLUMN block TEXT')
+
+
+def _member_presence(cursor: sqlite3.Cursor):
+    cursor.execute('ALTER TABLE users ADD COLUMN left_at REAL')
+
+
+def _render_jobs(cursor: sqlite3.Cursor):
+    cursor.execute('''
+        CREATE TABLE render_jobs (
+            guild_id INTEGER PRIMARY KEY,
+            force INTEGER NOT NULL DEFAULT 0,
+            first_marked REAL,
+            due_at REAL NOT NULL,
+            generation INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            claimed_by TEXT,
+            claimed_until REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX render_jobs_due_at ON render_jobs (due_at)')
+
+
+MIGRATIONS = [
+    _initial_schema,
+    _indexes,
+    _guild_partitioning,
+    _display_messages,
+    _bot_state,
+    _display_blocks,
+    _member_presence,
+    _render_jobs,
+]
+
+
+def migrate(cursor: sqlite3.Cursor):
+    """Upgrade the schema in place; meant to run inside a single transaction."""
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info(f'Migrating database to version {number} ({migration.__name__.strip("_")})')
+        migration(cursor)
+        cursor.execute(f'PRAGMA user_version = {number}')
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+import discord
+
+import metrics
+
+logger = logging.getLogger('discord')
+
+# Lower runs first
+PRIORITY_LOG = 0
+PRIORITY_DISPLAY = 1
+
+
+class _TokenBucket:
+    def __init__(self, rate: int, per: float):
+        self.capacity = rate
+        self.refill = rate / per
+        self.tokens = float(rate)
+        self.updated = asyncio.get_running_loop().time()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.refill)
+
+
+class _Operation:
+    __slots__ = ('priority', 'seq', 'call', 'key', 'future', 'submitted', 'guild_id')
+
+    def __init__(self, priority: int, seq: int, call: Callable[[], Awaitable[Any]], key: Optional[Hashable],
+                 future: asyncio.Future, submitted: float, guild_id: Optional[int]):
+        self.priority = priority
+        self.seq = seq
+        self.call = call
+        self.key = key
+        self.future = future
+        self.submitted = submitted
+        self.guild_id = guild_id
+
+    def __lt__(self, other: _Operation) -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def _guild_id(channel) -> Optional[int]:
+    # Partial channels only know the id of their guild
+    guild = getattr(channel, 'guild', None)
+    return guild.id if guild is not None else getattr(channel, 'guild_id', None)
+
+
+class _Route:
+    def __init__(self, rate: int, per: float):
+        self.queue: List[_Operation] = []
+        self.limiter = _TokenBucket(rate, per)
+        self.task: Optional[asyncio.Task] = None
+
+
+class Outbound:
+    """Paces outgoing channel operations per route bucket.
+
+    Every route (an operation kind on one channel) has its own priority queue and token bucket, and all
+    routes share a global bucket. Display maintenance yields to interaction traffic: an interaction holds
+    back the display operations of its guild for ``hold`` seconds so the response goes out first, but no
+    operation is held for more than ``max_hold`` seconds after it was queued. An edit that is still
+    queued when a newer edit of the same message arrives is replaced by it; both callers get the result
+    of the newer one.
+    """
+
+    def __init__(self, rate: int = 5, per: float = 5.0, global_rate: int = 40, hold: float = 1.0,
+                 max_hold: float = 5.0):
+        self.rate = rate
+        self.per = per
+        self.global_rate = global_rate
+        self.hold = hold
+        self.max_hold = max_hold
+        self._routes: Dict[Hashable, _Route] = {}
+        self._pending: Dict[Hashable, _Operation] = {}
+        self._global: Optional[_TokenBucket] = None
+        self._holds: Dict[Optional[int], float] = {}
+        self._seq = itertools.count()
+
+    def hold_background(self, guild_id: Optional[int]):
+        now = asyncio.get_running_loop().time()
+        if len(self._holds) > 1024:
+            self._holds = {key: until for key, until in self._holds.items() if until > now}
+        self._holds[guild_id] = now + self.hold
+
+    def submit(self, route: Hashable, call: Callable[[], Awaitable[Any]], priority: int = PRIORITY_DISPLAY,
+               key: Optional[Hashable] = None, guild_id: Optional[int] = None) -> asyncio.Future:
+        if key is not None and key in self._pending:
+            pending = self._pending[key]
+            pending.call = call
+            return pending.future
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        operation = _Operation(priority, next(self._seq), call, key, future, loop.time(), guild_id)
+        if key is not None:
+            self._pending[key] = operation
+
+        bucket = self._routes.get(route)
+        if bucket is None:
+            bucket = self._routes[route] = _Route(self.rate, self.per)
+        heapq.heappush(bucket.queue, operation)
+        if bucket.task is None or bucket.task.done():
+            bucket.task = asyncio.create_task(self._drain(route, bucket))
+        return future
+
+    async def _drain(self, route: Hashable, bucket: _Route):
+        loop = asyncio.get_running_loop()
+        if self._global is None:
+            self._global = _TokenBucket(self.global_rate, 1.0)
+
+        while bucket.queue:
+            operation = bucket.queue[0]
+            if operation.priority >= PRIORITY_DISPLAY:
+                hold_until = min(self._holds.get(operation.guild_id, 0.0), operation.submitted + self.max_hold)
+                if loop.time() < hold_until:
+                    await asyncio.sleep(hold_until - loop.time())
+                    continue
+            heapq.heappop(bucket.queue)
+            if operation.key is not None:
+                self._pending.pop(operation.key, None)
+            if operation.future.cancelled():
+                continue
+
+            await bucket.limiter.acquire()
+            await self._global.acquire()
+            started = loop.time()
+            metrics.registry.observe('rest_queue_seconds', started - operation.submitted, op=route[0])
+            metrics.registry.inc('rest_requests_total', op=route[0], channel=route[1])
+            try:
+                result = await operation.call()
+            except Exception as e:
+                metrics.registry.inc('rest_errors_total', op=route[0], channel=route[1], error=type(e).__name__)
+                if not operation.future.cancelled():
+                    operation.future.set_exception(e)
+            else:
+                if not operation.future.cancelled():
+                    operation.future.set_result(result)
+            finally:
+                metrics.registry.observe('rest_seconds', loop.time() - started, op=route[0])
+
+        self._routes.pop(route, None)
+
+    def send(self, channel, priority: int = PRIORITY_DISPLAY, file_path: Optional[str] = None,
+             **kwargs) -> asyncio.Future:
+        async def call():
+            file = discord.File(fp=file_path) if file_path else None
+            return await channel.send(file=file, **kwargs)
+        return self.submit(('send', channel.id), call, priority, guild_id=_guild_id(channel))
+
+    def edit(self, channel, message_id: int, priority: int = PRIORITY_DISPLAY,
+             file_path: Optional[str] = discord.utils.MISSING, **kwargs) -> asyncio.Future:
+        """Edit a message; ``file_path`` replaces its attachments, ``None`` removes them."""
+        async def call():
+            if file_path is not discord.utils.MISSING:
+                kwargs['attachments'] = [discord.File(fp=file_path)] if file_path else []
+            return await channel.get_partial_message(message_id).edit(**kwargs)
+        return self.submit(('edit', channel.id), call, priority, key=('edit', message_id),
+                           guild_id=_guild_id(channel))
+
+    def delete(self, channel, message_id: int, priority: int = PRIORITY_DISPLAY) -> asyncio.Future:
+        return self.submit(('delete', channel.id), channel.get_partial_message(message_id).delete, priority,
+                           key=('delete', message_id), guild_id=_guild_id(channel))
+
+    def bulk_delete(self, channel, message_ids: List[int], priority: int = PRIORITY_DISPLAY) -> asyncio.Future:
+        async def call():
+            if isinstance(channel, discord.PartialMessageable):
+                # Partial channels, as used without a gateway connection, have no bulk delete helper;
+                # like TextChannel.delete_messages, a single message goes through the plain delete route
+                # because bulk delete takes 2 to 100 ids
+                http = channel._state.http
+                if len(message_ids) == 1:
+                    return await http.delete_message(channel.id, message_ids[0])
+                return await http.delete_messages(channel.id, message_ids)
+            return await channel.delete_messages([discord.Object(id=i) for i in message_ids])
+        return self.submit(('bulk_delete', channel.id), call, priority, guild_id=_guild_id(channel))
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger('discord')
+
+
+class _GuildState:
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.first_mark: Optional[float] = None
+        self.last_mark: Optional[float] = None
+        self.force = False
+        self.task: Optional[asyncio.Task] = None
+
+
+class RefreshScheduler:
+    """Coalesces roster mutations into one render per guild.
+
+    Mutations only mark the guild dirty. A single task per guild renders once the guild has been quiet
+    for ``quiet_window`` seconds, or ``max_delay`` seconds after the first pending mutation, whichever comes first.
+    Renders of one guild never overlap. Every shard has its own pool of ``workers`` render slots, so a burst
+    of renders on one shard never delays the guilds of another.
+    """
+
+    def __init__(self, render: Callable[[int, bool], Awaitable[None]], quiet_window: float, max_delay: float,
+                 shard_of: Callable[[int], int] = lambda guild_id: 0, workers: int = 2):
+        self._render = render
+        self.quiet_window = quiet_window
+        self.max_delay = max_delay
+        self.workers = workers
+        self._shard_of = shard_of
+        self._guilds: Dict[int, _GuildState] = {}
+        self._slots: Dict[int, asyncio.Semaphore] = {}
+
+    def _shard_slots(self, guild_id: int) -> Tuple[int, asyncio.Semaphore]:
+        shard = self._shard_of(guild_id)
+        slots = self._slots.get(shard)
+        if slots is None:
+            slots = self._slots[shard] = asyncio.Semaphore(self.workers)
+        return shard, slots
+
+    def mark_dirty(self, guild_id: int, force: bool = False):
+        state = self._guilds.get(guild_id)
+        if state is None:
+            state = self._guilds[guild_id] = _GuildState()
+
+        now = asyncio.get_running_loop().time()
+        if state.first_mark is None:
+            state.first_mark = now
+        state.last_mark = now
+        state.force = state.force or force
+        state.event.set()
+
+        if state.task is None or state.task.done():
+            state.task = asyncio.create_task(self._worker(guild_id, state))
+
+    async def _worker(self, guild_id: int, state: _GuildState):
+        loop = asyncio.get_running_loop()
+        while True:
+            await state.event.wait()
+
+            # Wait for the quiet window, restarting it on every new mutation up to the max delay
+            while True:
+                state.event.clear()
+                deadline = min(state.last_mark + self.quiet_window, state.first_mark + self.max_delay)
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(state.event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            shard, slots = self._shard_slots(guild_id)
+            queued = loop.time()
+            async with slots:
+                metrics.registry.observe('render_wait_seconds', loop.time() - queued, shard=str(shard))
+                # Taken after the wait for a slot, so mutations made meanwhile go into this render
+                force = state.force
+                state.force = False
+                state.first_mark = None
+                state.event.clear()
+
+                try:
+                    await self._render(guild_id, force)
+                except Exception:
+                    logger.exception(f'Error while updating display channel of guild {guild_id}')
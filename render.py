@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import datetime
+import hashlib
+import logging
+import os
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import discord
+
+import database
+import metrics
+import outbound
+
+logger = logging.getLogger('discord')
+
+MESSAGE_LIMIT = 2000
+# Fresh blocks are packed this full, so a few added lines fit without pushing later blocks down
+SOFT_LIMIT = 1800
+BLANK = '** **'
+# Bulk delete takes up to 100 messages that are younger than two weeks
+BULK_DELETE_LIMIT = 100
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+
+
+class DisplayMessage(NamedTuple):
+    content: str
+    file: Optional[str] = None
+    block: Optional[str] = None
+
+
+class Line(NamedTuple):
+    text: str
+    # Headers are glued to the line after them so a group never starts at the bottom of a message
+    keep_with_next: bool = False
+
+
+class Block(NamedTuple):
+    """A run of consecutive display messages that belongs to one anchor, such as a group."""
+    key: str
+    lines: Sequence[Line] = ()
+    # Fixed messages that go before the packed lines
+    messages: Sequence[DisplayMessage] = ()
+
+
+class RenderedMessage(NamedTuple):
+    id: int
+    content_hash: str
+    file: Optional[str] = None
+    block: Optional[str] = None
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class DisplayMap:
+    """Ordered ids and content hashes of the display messages the bot owns, persisted per guild.
+
+    Renders address messages by id through this map, so the channel history only has to be read
+    when the map is missing or has been marked stale.
+    """
+
+    def __init__(self, db: database.Database):
+        self.db = db
+        self._maps: Dict[int, Tuple[int, List[RenderedMessage]]] = {}
+
+    async def load(self, guild_id: int, channel_id: int) -> Optional[List[RenderedMessage]]:
+        if guild_id in self._maps:
+            metrics.registry.inc('cache_requests_total', cache='display_map', result='hit')
+        else:
+            rows = await self.db.fetchall('''
+                SELECT position, channel_id, message_id, content_hash, file, block FROM display_messages
+                WHERE guild_id = ? ORDER BY position
+            ''', (guild_id,))
+            # Gaps are left by a partial save that raced with an invalidation, read the history instead
+            if (not rows or any(row[0] != position or row[1] != rows[0][1]
+                                for position, row in enumerate(rows))):
+                metrics.registry.inc('cache_requests_total', cache='display_map', result='miss')
+                return None
+            # Loaded from disk, the channel history does not have to be read
+            metrics.registry.inc('cache_requests_total', cache='display_map', result='stored')
+            self._maps[guild_id] = (rows[0][1], [RenderedMessage(*row[2:]) for row in rows])
+
+        stored_channel_id, messages = self._maps[guild_id]
+        if stored_channel_id != channel_id:
+            return None
+        return messages
+
+    async def save(self, guild_id: int, channel_id: int, messages: List[RenderedMessage]):
+        stored = self._maps.get(guild_id)
+        if stored == (channel_id, messages):
+            return
+
+        if stored is not None and stored[0] == channel_id:
+            # Only rewrite the positions this render changed
+            previous = stored[1]
+            changed = [(position, message) for position, message in enumerate(messages)
+                       if position >= len(previous) or previous[position] != message]
+            replace_all = False
+        else:
+            previous = []
+            changed = list(enumerate(messages))
+            replace_all = True
+
+        def save(cursor):
+            rows, rewrite = changed, replace_all
+            if not rewrite:
+                # Another process may have invalidated the map while this render ran, the unchanged
+                # positions are only still stored if the rows are the ones this copy was loaded from
+                stored_count, = cursor.execute('''
+                    SELECT COUNT(*) FROM display_messages WHERE guild_id = ? AND channel_id = ?
+                ''', (guild_id, channel_id)).fetchone()
+                if stored_count != len(previous):
+                    rows, rewrite = list(enumerate(messages)), True
+            if rewrite:
+                cursor.execute('DELETE FROM display_messages WHERE guild_id = ?', (guild_id,))
+            elif len(previous) > len(messages):
+                cursor.execute('DELETE FROM display_messages WHERE guild_id = ? AND position >= ?',
+                               (guild_id, len(messages)))
+            cursor.executemany('''
+                INSERT OR REPLACE INTO display_messages
+                    (guild_id, position, channel_id, message_id, content_hash, file, block)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(guild_id, position, channel_id, *message) for position, message in rows])
+
+        await self.db.transaction(save)
+        self._maps[guild_id] = (channel_id, messages)
+
+    def forget(self, guild_id: int):
+        """Drops the in-memory copy, the next load reads the stored map again."""
+        self._maps.pop(guild_id, None)
+
+    async def invalidate(self, guild_id: int):
+        self._maps.pop(guild_id, None)
+        await self.db.execute('DELETE FROM display_messages WHERE guild_id = ?', (guild_id,))
+
+
+def pack(lines: List[Line], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Pack consecutive lines into as few messages as possible without exceeding the content limit."""
+    chunks = []
+    chunk = []
+    for line in lines:
+        # A line longer than a lowered limit still fits a message of its own
+        chunk.append(line.text[:MESSAGE_LIMIT])
+        if not line.keep_with_next:
+            chunks.append(chunk)
+            chunk = []
+    if chunk:
+        chunks.append(chunk)
+
+    messages = []
+    current = []
+    size = 0
+    for chunk in chunks:
+        chunk_size = sum(len(text) for text in chunk) + len(chunk) - 1
+        if chunk_size > limit:
+            # Too big to keep together, fall back to line by line
+            pieces = [[text] for text in chunk]
+        else:
+            pieces = [chunk]
+        for piece in pieces:
+            piece_size = sum(len(text) for text in piece) + len(piece) - 1
+            if current and size + 1 + piece_size > limit:
+                messages.append('\n'.join(current))
+                current = []
+                size = 0
+            size += piece_size + (1 if current else 0)
+            current.extend(piece)
+    if current:
+        messages.append('\n'.join(current))
+    return messages
+
+
+def _pack_into(lines: Sequence[Line], count: int) -> List[str]:
+    """Pack lines into at most ``count`` messages, spreading them as evenly as the content limit allows."""
+    low, high = 1, MESSAGE_LIMIT
+    while low < high:
+        middle = (low + high) // 2
+        if len(pack(lines, middle)) <= count:
+            high = middle
+        else:
+            low = middle + 1
+    return pack(lines, low)
+
+
+def _pack_block(lines: Sequence[Line], previous: int) -> List[str]:
+    if not lines:
+        return []
+    contents = pack(lines, SOFT_LIMIT)
+    if not previous or len(contents) == previous:
+        return contents
+    # Keep the message count of the last render while the content allows, so neighbouring blocks stay put
+    if len(contents) + 1 < previous or len(pack(lines)) > previous:
+        return contents
+    contents = _pack_into(lines, previous)
+    return contents + [BLANK] * (previous - len(contents))
+
+
+def layout(blocks: List[Block], current: List[RenderedMessage]) -> List[DisplayMessage]:
+    """Turn blocks into display messages, giving each block as many messages as it had in ``current``.
+
+    Messages are matched by position, so a block that keeps its message count leaves every other
+    block untouched and a change only rewrites the block it happened in.
+    """
+    previous = collections.Counter(message.block for message in current if message.block is not None)
+    desired = []
+    for block in blocks:
+        desired.extend(message._replace(block=block.key) for message in block.messages)
+        contents = _pack_block(block.lines, previous[block.key] - len(block.messages))
+        desired.extend(DisplayMessage(content=content, block=block.key) for content in contents)
+    return desired
+
+
+def _file_name(path: Optional[str]) -> Optional[str]:
+    return os.path.basename(path) if path else None
+
+
+async def delete_messages(channel, message_ids: List[int], rest: outbound.Outbound):
+    """Delete messages in as few requests as possible.
+
+    Messages inside the bulk delete window go out in batches of 100, older ones are deleted one by one.
+    """
+    cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+    recent = [i for i in message_ids if discord.utils.snowflake_time(i) > cutoff]
+    old = [i for i in message_ids if discord.utils.snowflake_time(i) <= cutoff]
+
+    for start in range(0, len(recent), BULK_DELETE_LIMIT):
+        batch = recent[start:start + BULK_DELETE_LIMIT]
+        try:
+            await rest.bulk_delete(channel, batch)
+        except discord.Forbidden:
+            # Bulk delete needs Manage Messages, our own messages can still be deleted one by one
+            old.extend(batch)
+        except discord.NotFound:
+            pass
+
+    results = await asyncio.gather(*(rest.delete(channel, message_id) for message_id in old), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception) and not isinstance(result, discord.NotFound):
+            raise result
+
+
+async def reconcile(channel, bot_user: discord.abc.User, rest: outbound.Outbound) -> List[RenderedMessage]:
+    """Rebuild the message map of a channel from its history, removing foreign messages."""
+    metrics.registry.inc('render_reconciles_total')
+    owned = []
+    foreign = []
+    async for msg in channel.history(oldest_first=True, limit=None):
+        if msg.type != discord.MessageType.default:
+            continue
+        if msg.author != bot_user:
+            foreign.append(msg.id)
+            continue
+        file = msg.attachments[0].filename if msg.attachments else None
+        owned.append(RenderedMessage(id=msg.id, content_hash=content_hash(msg.content), file=file))
+    await delete_messages(channel, foreign, rest)
+    return owned
+
+
+async def _apply(channel, current: List[RenderedMessage], desired: List[DisplayMessage],
+                 rest: outbound.Outbound) -> List[RenderedMessage]:
+    # Everything is queued up front, the outbound scheduler paces it and keeps the sends in order
+    operations = []
+    for position, message in enumerate(desired):
+        if position < len(current):
+            old = current[position]
+            if old.file != _file_name(message.file):
+                operations.append(rest.edit(channel, old.id, content=message.content, file_path=message.file))
+            elif old.content_hash != content_hash(message.content):
+                operations.append(rest.edit(channel, old.id, content=message.content))
+        else:
+            operations.append(rest.send(channel, content=message.content, file_path=message.file))
+    # Let every queued operation finish before failing, a reconcile must see the messages sent after an error
+    results = await asyncio.gather(*operations, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        raise next((e for e in errors if isinstance(e, discord.NotFound)), errors[0])
+    stale = [old.id for old in current[len(desired):]]
+    await delete_messages(channel, stale, rest)
+    metrics.registry.observe('render_messages_touched', len(operations) + len(stale))
+
+    sent = iter(results[-(len(desired) - len(current)):] if len(desired) > len(current) else [])
+    rendered = []
+    for position, message in enumerate(desired):
+        message_id = current[position].id if position < len(current) else next(sent).id
+        rendered.append(RenderedMessage(id=message_id, content_hash=content_hash(message.content),
+                                        file=_file_name(message.file), block=message.block))
+    return rendered
+
+
+async def render(guild_id: int, channel, bot_user: discord.abc.User, blocks: List[Block],
+                 display_map: DisplayMap, rest: outbound.Outbound, force: bool = False):
+    """Bring the channel to the desired state, touching only messages that differ from the last render."""
+    with metrics.registry.timer('render_seconds'):
+        await _render(guild_id, channel, bot_user, blocks, display_map, rest, force)
+
+
+async def _render(guild_id: int, channel, bot_user: discord.abc.User, blocks: List[Block],
+                  display_map: DisplayMap, rest: outbound.Outbound, force: bool):
+    current = None if force else await display_map.load(guild_id, channel.id)
+    if current is None:
+        current = await reconcile(channel, bot_user, rest)
+
+    try:
+        rendered = await _apply(channel, current, layout(blocks, current), rest)
+    except discord.NotFound:
+        # Somebody removed one of our messages by hand, start over from the real channel state
+        logger.warning(f'Display channel {channel.id} changed outside of the bot, reconciling')
+        try:
+            current = await reconcile(channel, bot_user, rest)
+            rendered = await _apply(channel, current, layout(blocks, current), rest)
+        except Exception:
+            await display_map.invalidate(guild_id)
+            raise
+    except Exception:
+        await display_map.invalidate(guild_id)
+        raise
+
+    await display_map.save(guild_id, channel.id, rendered)
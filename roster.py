@@ -0,0 +1,483 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import logging
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, Union
+
+import database
+import metrics
+
+logger = logging.getLogger('discord')
+
+# Discord shows at most 25 autocomplete choices
+AUTOCOMPLETE_LIMIT = 25
+# Returned by rename_group when another group of the guild already has the new name
+NAME_TAKEN = object()
+
+
+class Member(NamedTuple):
+    id: int
+    discord_id: int
+    discord_name: str
+    steam_name: str
+    steam_profile: str
+    group_id: int
+    # Unix time the user left the guild, None while they are a member
+    left_at: Optional[float] = None
+
+
+class Group:
+    def __init__(self, id: int, name: str, priority: int):
+        self.id = id
+        self.name = name
+        self.priority = priority
+        # Kept in users.id order, the order members were added in
+        self.members: List[Member] = []
+
+    def insert(self, member: Member):
+        ids = [m.id for m in self.members]
+        self.members.insert(bisect.bisect(ids, member.id), member)
+
+    def discard(self, discord_id: int):
+        self.members = [m for m in self.members if m.discord_id != discord_id]
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class GroupIndex:
+    """Autocomplete index over group names.
+
+    Matches are ranked exact, then prefix, then substring, each by group priority. Substring candidates
+    are narrowed down with a trigram index; when nothing contains the query, groups sharing the most
+    trigrams with it are offered instead, which tolerates typos.
+    """
+
+    def __init__(self, groups: List[Group]):
+        self._groups = sorted(groups, key=lambda g: (g.priority, g.id))
+        self._names = [group.name.casefold() for group in self._groups]
+        self._trigrams: Dict[str, Set[int]] = {}
+        for position, name in enumerate(self._names):
+            for trigram in _trigrams(name):
+                self._trigrams.setdefault(trigram, set()).add(position)
+
+    def search(self, query: str, limit: int = AUTOCOMPLETE_LIMIT) -> List[Group]:
+        query = query.casefold().strip()
+        if not query:
+            return self._groups[:limit]
+
+        query_trigrams = _trigrams(query)
+        if query_trigrams:
+            candidates = set.intersection(*(self._trigrams.get(t, set()) for t in query_trigrams))
+        else:
+            candidates = range(len(self._groups))
+
+        exact, prefix, substring = [], [], []
+        for position in sorted(candidates):
+            name = self._names[position]
+            if name == query:
+                exact.append(position)
+            elif name.startswith(query):
+                prefix.append(position)
+            elif query in name:
+                substring.append(position)
+        ranked = exact + prefix + substring
+
+        if not ranked and query_trigrams:
+            shared: Dict[int, int] = {}
+            for trigram in query_trigrams:
+                for position in self._trigrams.get(trigram, ()):
+                    shared[position] = shared.get(position, 0) + 1
+            ranked = sorted(shared, key=lambda p: (-shared[p], p))
+
+        return [self._groups[position] for position in ranked[:limit]]
+
+
+class Roster:
+    """Groups, members, channel settings and command permissions of one guild."""
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.groups: Dict[int, Group] = {}
+        self.members: Dict[int, Member] = {}
+        self.display_channel_id: Optional[int] = None
+        self.logging_channel_id: Optional[int] = None
+        self.allowed_roles: Set[int] = set()
+        self._index: Optional[GroupIndex] = None
+
+    def search_groups(self, query: str) -> List[Group]:
+        if self._index is None:
+            self._index = GroupIndex(list(self.groups.values()))
+        return self._index.search(query)
+
+    def invalidate_index(self):
+        self._index = None
+
+    def ordered_groups(self) -> List[Group]:
+        # Lower priority goes first, ties keep creation order
+        return sorted(self.groups.values(), key=lambda g: (g.priority, g.id))
+
+    def group_by_name(self, name: str) -> Optional[Group]:
+        for group in self.groups.values():
+            if group.name == name:
+                return group
+        return None
+
+
+class RosterStore:
+    """Lazily loaded in-memory rosters with write-through to SQLite.
+
+    Mutations write to the database first and only touch memory after the transaction committed.
+    If a write fails the guild's roster is dropped and reloaded on next use, so memory never
+    drifts from what is on disk.
+    """
+
+    def __init__(self, db: database.Database):
+        self.db = db
+        self._rosters: Dict[int, Roster] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def _lock(self, guild_id: int) -> asyncio.Lock:
+        lock = self._locks.get(guild_id)
+        if lock is None:
+            lock = self._locks[guild_id] = asyncio.Lock()
+        return lock
+
+    def peek(self, guild_id: int) -> Optional[Roster]:
+        """Returns the roster only if it is already loaded."""
+        return self._rosters.get(guild_id)
+
+    def invalidate(self, guild_id: int):
+        self._rosters.pop(guild_id, None)
+
+    async def get(self, guild_id: int) -> Roster:
+        roster = self._rosters.get(guild_id)
+        if roster is not None:
+            metrics.registry.inc('cache_requests_total', cache='roster', result='hit')
+            return roster
+        metrics.registry.inc('cache_requests_total', cache='roster', result='miss')
+        async with self._lock(guild_id):
+            return await self._load(guild_id)
+
+    async def _load(self, guild_id: int) -> Roster:
+        roster = self._rosters.get(guild_id)
+        if roster is not None:
+            return roster
+
+        def load(cursor):
+            settings = cursor.execute('SELECT display_channel_id, logging_channel_id FROM settings WHERE guild_id = ?',
+                                      (guild_id,)).fetchone()
+            groups = cursor.execute('SELECT id, name, priority FROM groups WHERE guild_id = ? ORDER BY id',
+                                    (guild_id,)).fetchall()
+            users = cursor.execute('''
+                SELECT id, discord_id, discord_name, steam_name, steam_profile, group_id, left_at
+                FROM users WHERE guild_id = ? ORDER BY id
+            ''', (guild_id,)).fetchall()
+            roles = cursor.execute('SELECT role_id FROM permissions WHERE guild_id = ?', (guild_id,)).fetchall()
+            return settings, groups, users, roles
+
+        settings, groups, users, roles = await self.db.transaction(load)
+
+        roster = Roster(guild_id)
+        if settings is not None:
+            roster.display_channel_id, roster.logging_channel_id = settings
+        for group_id, name, priority in groups:
+            roster.groups[group_id] = Group(group_id, name, priority)
+        for row in users:
+            member = Member(*row)
+            group = roster.groups.get(member.group_id)
+            if group is None:
+                continue
+            group.members.append(member)
+            roster.members[member.discord_id] = member
+        roster.allowed_roles = {role_id for role_id, in roles}
+
+        self._rosters[guild_id] = roster
+        return roster
+
+    async def _write(self, guild_id: int, fn):
+        try:
+            return await self.db.transaction(fn)
+        except Exception:
+            self.invalidate(guild_id)
+            raise
+
+    async def set_channels(self, guild_id: int, display_channel_id: int, logging_channel_id: Optional[int]):
+        async with self._lock(guild_id):
+            roster = await self._load(guild_id)
+            await self._write(guild_id, lambda cursor: cursor.execute('''
+                INSERT INTO settings (display_channel_id, guild_id, logging_channel_id)
+                VALUES (?, ?, ?)
+                ON CONFLICT(guild_id) DO UPDATE SET
+                    display_channel_id = excluded.display_channel_id,
+                    logging_channel_id = excluded.logging_channel_id
+            ''', (display_channel_id, guild_id, logging_channel_id)))
+            roster.display_channel_id = display_channel_id
+            roster.logging_channel_id = logging_channel_id
+
+    async def create_group(self, guild_id: int, name: str, priority: int) -> Optional[Group]:
+        """Returns the new group, or None if a group with that name already exists."""
+        async with self._lock(guild_id):
+            roster = await self._load(guild_id)
+            if roster.group_by_name(name) is not None:
+                return None
+
+            group_id = await self._write(guild_id, lambda cursor: cursor.execute(
+                'INSERT INTO groups (guild_id, name, priority) VALUES (?, ?, ?)', (guild_id, name, priority)).lastrowid)
+            group = roster.groups[group_id] = Group(group_id, name, priority)
+            roster.invalidate_index()
+            return group
+
+    async def delete_group(self, guild_id: int, group_id: int) -> Optional[Group]:
+        """Returns the deleted group, or None if it does not exist."""
+        async with self._lock(guild_id):
+            roster = await self._load(guild_id)
+            group = roster.groups.get(group_id)
+            if group is None:
+                return None
+
+            def delete(cursor):
+                cursor.execute('DELETE FROM users WHERE group_id = ?', (group_id,))
+                cursor.execute('DELETE FROM groups WHERE id = ?', (group_id,))
+
+            await self._write(guild_id, delete)
+            del roster.groups[group_id]
+            roster.invalidate_index()
+            for member in group.members:
+                roster.members.pop(member.discord_id, None)
+            return group
+
+    async def rename_group(self, guild_id: int, group_id: int, name: str, priority: int) -> Union[str, object, None]:
+        """Returns the previous name of the group, None if it does not exist or NAME_TAKEN if the name is in use."""
+        async with self._lock(guild_id):
+            roster = await self._load(guild_id)
+            group = roster.groups.get(group_id)
+            if group is None:
+                return None
+            existing = roster.group_by_name(name)
+            if existing is not None and existing.id != group_id:
+                return NAME_TAKEN
+
+            await self._write(guild_id, lambda cursor: cursor.execute(
+                'UPDATE groups SET name = ?, priority = ? WHERE id = ?', (name, priority, group_id)))
+            old_name = group.name
+            group.name = name
+            group.priority = priority
+            roster.invalidate_index()
+            return old_name
+
+    async def add_user(self, guild_id: int, group_id: int, discord_id: int, discord_name: str, steam_name: str,
+                       steam_profile: str) -> Optional[Group]:
+        """Adds the user to a group, replacing any previous entry. Returns None if the group does not exist."""
+        async with self._lock(guild_id):
+            roster = await self._load(guild_id)
+            group = roster.groups.get(group_id)
+            if group is None:
+                return None
+
+            def add(cursor):
+                cursor.execute('DELETE FROM users WHERE guild_id = ? AND discord_id = ?', (guild_id, discord_id))
+                return cursor.execute('''
+                    INSERT INTO users (guild_id, discord_id, discord_name, steam_name, steam_profile, group_id)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (guild_id, discord_id, discord_name, steam_name, steam_profile, group_id)).lastrowid
+
+            user_id = await self._write(guild_id, add)
+            self._discard_member(roster, discord_id)
+            member = Member(user_id, discord_id, discord_name, steam_name, steam_profile, group_id)
+            group.insert(member)
+            roster.members[discord_id] = member
+            return group
+
+    async def remove_user(self, guild_id: int, discord_id: int) -> bool:
+        async with self._lock(guild_id):
+            roster = await self._load(guild_id)
+            await self._write(guild_id, lambda cursor: cursor.execute(
+                'DELETE FROM users WHERE guild_id = ? AND discord_id = ?', (guild_id, discord_id)))
+            return self._discard_member(roster, discord_id) is not None
+
+    async def move_user(self, guild_id: int, discord_id: int, group_id: int) -> Optional[Group]:
+        """Returns the target group, or None if it does not exist."""
+        async with self._lock(guild_id):
+            roster = await self._load(guild_id)
+            group = roster.groups.get(group_id)
+            if group is None:
+                return None
+
+            await self._write(guild_id, lambda cursor: cursor.execute(
+                'UPDATE users SET group_id = ? WHERE guild_id = ? AND discord_id = ?', (group_id, guild_id, discord_id)))
+            member = self._discard_member(roster, discord_id)
+            if member is not None:
+                member = member._replace(group_id=group_id)
+                group.insert(member)
+                roster.members[discord_id] = member
+            return group
+
+    async def add_users(self, guild_id: int, group_id: int,
+                        users: List[Tuple[int, str, str, str]]) -> Optional[Group]:
+        """Adds ``(discord_id, discord_name, steam_name, steam_profile)`` entries to a group in one transaction."""
+        async with self._lock(guild_id):
+            roster = await self._load(guild_id)
+            group = roster.groups.get(group_id)
+            if group is None:
+                return None
+
+            def add(cursor):
+                cursor.executemany('DELETE FROM users WHERE guild_id = ? AND discord_id = ?',
+                                   [(guild_id, user[0]) for user in users])
+                return [cursor.execute('''
+                    INSERT INTO users (guild_id, discord_id, discord_name, steam_name, steam_profile, group_id)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (guild_id, *user, group_id)).lastrowid for user in users]
+
+            user_ids = await self._write(guild_id, add)
+            for user_id, user in zip(user_ids, users):
+                self._discard_member(roster, user[0])
+                member = Member(user_id, *user, group_id)
+                group.insert(member)
+                roster.members[member.discord_id] = member
+            return group
+
+    async def remove_users(self, guild_id: int, discord_ids: List[int]) -> List[int]:
+        """Removes users from all groups in one transaction. Returns the ids that were in a group."""
+        async with self._lock(guild_id):
+            roster = await self._load(guild_id)
+            await self._write(guild_id, lambda cursor: cursor.executemany(
+                'DELETE FROM users WHERE guild_id = ? AND discord_id = ?',
+                [(guild_id, discord_id) for discord_id in discord_ids]))
+            return [discord_id for discord_id in discord_ids if self._discard_member(roster, discord_id) is not None]
+
+    async def move_users(self, guild_id: int, discord_ids: List[int],
+                         group_id: int) -> Optional[Tuple[Group, List[int]]]:
+        """Moves users in one transaction. Returns the target group and the ids that were in a group,
+        or None if the group does not exist."""
+        async with self._lock(guild_id):
+            roster = await self._load(guild_id)
+            group = roster.groups.get(group_id)
+            if group is None:
+                return None
+
+            present = [discord_id for discord_id in discord_ids if discord_id in roster.members]
+            await self._write(guild_id, lambda cursor: cursor.executemany(
+                'UPDATE users SET group_id = ? WHERE guild_id = ? AND discord_id = ?',
+                [(group_id, guild_id, discord_id) for discord_id in present]))
+            for discord_id in present:
+                member = self._discard_member(roster, discord_id)._replace(group_id=group_id)
+                group.insert(member)
+                roster.members[discord_id] = member
+            return group, present
+
+    async def merge_import(self, guild_id: int, import_id: str) -> Tuple[int, int]:
+        """Merges staged import rows in one transaction. Returns the number of groups created and users imported.
+
+        Groups are matched by name and take the staged priority if one was given; staged users replace
+        existing entries of the same user.
+        """
+        async with self._lock(guild_id):
+            def merge(cursor):
+                created = cursor.execute('''
+                    INSERT OR IGNORE INTO groups (guild_id, name, priority)
+                    SELECT ?, group_name, COALESCE(MAX(priority), 0) FROM temp.import_rows
+                    WHERE import_id = ? GROUP BY group_name ORDER BY MIN(line)
+                ''', (guild_id, import_id)).rowcount
+                cursor.execute('''
+                    UPDATE groups SET priority = (
+                        SELECT MAX(priority) FROM temp.import_rows
+                        WHERE import_id = ? AND group_name = groups.name
+                    )
+                    WHERE guild_id = ? AND name IN (
+                        SELECT group_name FROM temp.import_rows WHERE import_id = ? AND priority IS NOT NULL
+                    )
+                ''', (import_id, guild_id, import_id))
+                cursor.execute('''
+                    DELETE FROM users
+                    WHERE guild_id = ? AND discord_id IN (SELECT discord_id FROM temp.import_rows WHERE import_id = ?)
+                ''', (guild_id, import_id))
+                imported = cursor.execute('''
+                    INSERT INTO users (guild_id, discord_id, discord_name, steam_name, steam_profile, group_id)
+                    SELECT ?, r.discord_id, r.discord_name, r.steam_name, r.steam_profile, g.id
+                    FROM temp.import_rows r JOIN groups g ON g.guild_id = ? AND g.name = r.group_name
+                    WHERE r.import_id = ? ORDER BY r.line
+                ''', (guild_id, guild_id, import_id)).rowcount
+                cursor.execute('DELETE FROM temp.import_rows WHERE import_id = ?', (import_id,))
+                return created, imported
+
+            result = await self._write(guild_id, merge)
+            # Reloaded on next use, cheaper than patching thousands of members in
+            self.invalidate(guild_id)
+            return result
+
+    async def refresh_members(self, guild_id: int, names: Dict[int, str], departed: Iterable[int] = ()) -> bool:
+        """Stores current names of users that are in the guild and flags users that left it.
+
+        Ids that are not on the roster are ignored and only rows that actually change are written.
+        Returns True if somebody left or came back, which is the part the display shows.
+        """
+        async with self._lock(guild_id):
+            roster = await self._load(guild_id)
+            changed = []
+            for discord_id, name in names.items():
+                member = roster.members.get(discord_id)
+                if member is not None and (member.discord_name != name or member.left_at is not None):
+                    changed.append(member._replace(discord_name=name, left_at=None))
+            now = time.time()
+            for discord_id in departed:
+                member = roster.members.get(discord_id)
+                if member is not None and member.left_at is None:
+                    changed.append(member._replace(left_at=now))
+            if not changed:
+                return False
+
+            await self._write(guild_id, lambda cursor: cursor.executemany(
+                'UPDATE users SET discord_name = ?, left_at = ? WHERE id = ?',
+                [(member.discord_name, member.left_at, member.id) for member in changed]))
+            presence_changed = False
+            for member in changed:
+                previous = self._discard_member(roster, member.discord_id)
+                presence_changed |= (previous.left_at is None) != (member.left_at is None)
+                roster.groups[member.group_id].insert(member)
+                roster.members[member.discord_id] = member
+            return presence_changed
+
+    async def allow_role(self, guild_id: int, role_id: int) -> bool:
+        """Returns False if the role already had access."""
+        async with self._lock(guild_id):
+            roster = await self._load(guild_id)
+            if role_id in roster.allowed_roles:
+                return False
+            await self._write(guild_id, lambda cursor: cursor.execute(
+                'INSERT OR IGNORE INTO permissions (guild_id, role_id) VALUES (?, ?)', (guild_id, role_id)))
+            roster.allowed_roles.add(role_id)
+            return True
+
+    async def deny_role(self, guild_id: int, role_id: int) -> bool:
+        """Returns False if the role did not have access."""
+        async with self._lock(guild_id):
+            roster = await self._load(guild_id)
+            if role_id not in roster.allowed_roles:
+                return False
+            await self._write(guild_id, lambda cursor: cursor.execute(
+                'DELETE FROM permissions WHERE guild_id = ? AND role_id = ?', (guild_id, role_id)))
+            roster.allowed_roles.discard(role_id)
+            return True
+
+    async def forget_role(self, guild_id: int, role_id: int):
+        """Drops a role that no longer exists, whether or not the guild is loaded."""
+        async with self._lock(guild_id):
+            roster = self._rosters.get(guild_id)
+            if roster is not None and role_id not in roster.allowed_roles:
+                return
+            await self._write(guild_id, lambda cursor: cursor.execute(
+                'DELETE FROM permissions WHERE guild_id = ? AND role_id = ?', (guild_id, role_id)))
+            if roster is not None:
+                roster.allowed_roles.discard(role_id)
+
+    @staticmethod
+    def _discard_member(roster: Roster, discord_id: int) -> Optional[Member]:
+        member = roster.members.pop(discord_id, None)
+        if member is not None and member.group_id in roster.groups:
+            roster.groups[member.group_id].discard(discord_id)
+        return member
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+from typing import List
+
+import roster
+
+CSV_COLUMNS = ['group', 'priority', 'discord_id', 'discord_name', 'steam_name', 'steam_profile']
+
+
+def _backup(source_path: str, target_path: str, guild_id: int):
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        # One step inside a single read transaction: a consistent copy that never blocks WAL writers
+        source.backup(target)
+        target.isolation_level = None
+        tables = [name for name, in target.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        target.execute('BEGIN')
+        for table in tables:
+            columns = {row[1] for row in target.execute(f'PRAGMA table_info("{table}")')}
+            if 'guild_id' in columns:
+                target.execute(f'DELETE FROM "{table}" WHERE guild_id IS NOT ?', (guild_id,))
+            else:
+                target.execute(f'DELETE FROM "{table}"')
+        target.execute('COMMIT')
+        target.execute('VACUUM')
+    finally:
+        target.close()
+        source.close()
+
+
+async def database(source_path: str, guild_id: int, directory: str) -> str:
+    """Snapshot of the live database holding only ``guild_id``'s rows, written to ``directory``."""
+    path = os.path.join(directory, 'bot_data.db')
+    await asyncio.to_thread(_backup, source_path, path, guild_id)
+    return path
+
+
+def _rows(guild_roster: roster.Roster) -> List[list]:
+    return [[group.name, group.priority, member.discord_id, member.discord_name, member.steam_name,
+             member.steam_profile]
+            for group in guild_roster.ordered_groups() for member in group.members]
+
+
+def _write_csv(path: str, rows: List[list]):
+    with open(path, 'w', newline='', encoding='utf-8-sig') as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_COLUMNS)
+        writer.writerows(rows)
+
+
+def _write_json(path: str, groups: List[dict]):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({'groups': groups}, file, ensure_ascii=False, indent=1)
+
+
+async def roster_export(guild_roster: roster.Roster, format: str, directory: str) -> str:
+    """Export the roster as ``csv`` or ``json``; the data is copied before the file is written off the loop."""
+    if format == 'csv':
+        path = os.path.join(directory, 'roster.csv')
+        await asyncio.to_thread(_write_csv, path, _rows(guild_roster))
+    else:
+        groups = [{
+            'name': group.name,
+            'priority': group.priority,
+            'members': [{'discord_id': member.discord_id, 'discord_name': member.discord_name,
+                         'steam_name': member.steam_name, 'steam_profile': member.steam_profile}
+                        for member in group.members],
+        } for group in guild_roster.ordered_groups()]
+        path = os.path.join(directory, 'roster.json')
+        await asyncio.to_thread(_write_json, path, groups)
+    return path
+
+
+def _compress(path: str) -> str:
+    compressed = path + '.gz'
+    with open(path, 'rb') as source, gzip.open(compressed, 'wb', compresslevel=6) as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    return compressed
+
+
+async def compress(path: str) -> str:
+    return await asyncio.to_thread(_compress, path)
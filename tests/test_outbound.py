@@ -0,0 +1,47 @@
+import types
+import unittest
+
+import discord
+
+import outbound
+import render
+
+
+class FakeHTTP:
+    def __init__(self):
+        self.calls = []
+
+    async def delete_message(self, channel_id, message_id, *, reason=None):
+        self.calls.append(('delete_message', channel_id, message_id))
+
+    async def delete_messages(self, channel_id, message_ids, *, reason=None):
+        if not 2 <= len(message_ids) <= 100:
+            raise AssertionError('bulk delete takes 2 to 100 ids')
+        self.calls.append(('delete_messages', channel_id, list(message_ids)))
+
+
+def recent_id(offset: int = 0) -> int:
+    return discord.utils.time_snowflake(discord.utils.utcnow()) + offset
+
+
+class PartialChannelDeleteTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.http = FakeHTTP()
+        state = types.SimpleNamespace(http=self.http, _get_guild=lambda guild_id: None)
+        self.channel = discord.PartialMessageable(state=state, id=10, guild_id=1, type=discord.ChannelType.text)
+        self.rest = outbound.Outbound(rate=10 ** 6, per=1.0, global_rate=10 ** 6, hold=0.0)
+
+    async def test_single_message_trim_uses_plain_delete(self):
+        message_id = recent_id()
+        await render.delete_messages(self.channel, [message_id], self.rest)
+        self.assertEqual(self.http.calls, [('delete_message', 10, message_id)])
+
+    async def test_single_leftover_after_full_batch(self):
+        message_ids = [recent_id(offset) for offset in range(101)]
+        await render.delete_messages(self.channel, message_ids, self.rest)
+        self.assertEqual(self.http.calls, [('delete_messages', 10, message_ids[:100]),
+                                           ('delete_message', 10, message_ids[100])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import tempfile
+import types
+import unittest
+
+import discord
+
+import database
+import migrations
+import outbound
+import render
+
+
+def message(i: int) -> render.RenderedMessage:
+    return render.RenderedMessage(i, render.content_hash(str(i)))
+
+
+class DisplayMapSaveTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = database.Database(os.path.join(self.tmp.name, 'bot.db'))
+        await self.db.open()
+        await self.db.transaction(migrations.migrate)
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.tmp.cleanup()
+
+    async def test_save_after_invalidation_rewrites_whole_map(self):
+        worker, bot = render.DisplayMap(self.db), render.DisplayMap(self.db)
+        await worker.save(1, 10, [message(i) for i in range(3)])
+        self.assertIsNotNone(await worker.load(1, 10))
+
+        # The bot process invalidates the rows while the worker renders, which then changes one position
+        await bot.invalidate(1)
+        await worker.save(1, 10, [message(0), message(5), message(2)])
+
+        self.assertEqual(await render.DisplayMap(self.db).load(1, 10), [message(0), message(5), message(2)])
+
+    async def test_load_rejects_gaps(self):
+        display_map = render.DisplayMap(self.db)
+        await display_map.save(1, 10, [message(i) for i in range(3)])
+        await self.db.execute('DELETE FROM display_messages WHERE guild_id = 1 AND position = 0')
+
+        self.assertIsNone(await render.DisplayMap(self.db).load(1, 10))
+
+
+class FakeMessage:
+    def __init__(self, channel, id: int, content: str):
+        self.channel = channel
+        self.id = id
+        self.content = content
+        self.author = channel.author
+        self.attachments = []
+        self.type = discord.MessageType.default
+
+    async def edit(self, content=None, attachments=None):
+        self.channel.lookup(self.id).content = content
+
+    async def delete(self):
+        self.channel.messages.remove(self.channel.lookup(self.id))
+
+
+class FakeChannel:
+    def __init__(self, author):
+        self.id = 10
+        self.guild = types.SimpleNamespace(id=1)
+        self.author = author
+        self.messages = []
+        self._next_id = discord.utils.time_snowflake(discord.utils.utcnow())
+
+    def lookup(self, message_id: int) -> FakeMessage:
+        for msg in self.messages:
+            if msg.id == message_id:
+                return msg
+        raise discord.NotFound(types.SimpleNamespace(status=404, reason='Not Found'), 'Unknown Message')
+
+    async def history(self, oldest_first: bool = False, limit=None):
+        for msg in list(self.messages):
+            yield msg
+
+    async def send(self, content=None, file=None):
+        # Slower than the failing edit, so sends are still in flight when it fails
+        await asyncio.sleep(0.05)
+        self._next_id += 1
+        msg = FakeMessage(self, self._next_id, content)
+        self.messages.append(msg)
+        return msg
+
+    async def delete_messages(self, messages):
+        for message in messages:
+            self.messages.remove(self.lookup(message.id))
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(self, message_id, None)
+
+
+class RenderAfterManualDeleteTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = database.Database(os.path.join(self.tmp.name, 'bot.db'))
+        await self.db.open()
+        await self.db.transaction(migrations.migrate)
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.tmp.cleanup()
+
+    async def test_map_matches_channel(self):
+        bot_user = object()
+        channel = FakeChannel(bot_user)
+        display_map = render.DisplayMap(self.db)
+        rest = outbound.Outbound(rate=10 ** 6, per=1.0, global_rate=10 ** 6, hold=0.0)
+
+        def blocks(*keys):
+            return [render.Block(key, lines=[render.Line(f'{key} {i}') for i in range(3)]) for key in keys]
+
+        await render.render(1, channel, bot_user, blocks('a', 'b'), display_map, rest)
+        # Removed by hand, the next render's edit of it fails while the sends for the new groups are queued
+        channel.messages.pop(0)
+        await render.render(1, channel, bot_user, [render.Block('a', lines=[render.Line('changed')])]
+                            + blocks('b', 'c', 'd', 'e'), display_map, rest)
+
+        stored = await render.DisplayMap(self.db).load(1, channel.id)
+        self.assertEqual([message.id for message in stored], [msg.id for msg in channel.messages])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import os
+import tempfile
+import unittest
+
+import database
+import migrations
+import roster
+
+
+class RenameGroupTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = database.Database(os.path.join(self.tmp.name, 'bot.db'))
+        await self.db.open()
+        await self.db.transaction(migrations.migrate)
+        self.rosters = roster.RosterStore(self.db)
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.tmp.cleanup()
+
+    async def test_rename_to_existing_name(self):
+        first = await self.rosters.create_group(1, 'first', 0)
+        await self.rosters.create_group(1, 'second', 1)
+
+        self.assertIs(await self.rosters.rename_group(1, first.id, 'second', 0), roster.NAME_TAKEN)
+        self.assertEqual(first.name, 'first')
+
+    async def test_rename_keeping_name(self):
+        first = await self.rosters.create_group(1, 'first', 0)
+
+        self.assertEqual(await self.rosters.rename_group(1, first.id, 'first', 5), 'first')
+        self.assertEqual(first.priority, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+
+import discord
+
+import database
+import display
+import env
+import jobs
+import metrics
+import migrations
+import outbound
+import render
+import roster
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('discord')
+
+
+async def main(args: argparse.Namespace):
+    db = database.Database(args.database)
+    await db.open()
+    await db.transaction(migrations.migrate)
+    rosters = roster.RosterStore(db)
+    display_map = render.DisplayMap(db)
+    rest = outbound.Outbound(rate=5, per=5.0, global_rate=args.global_rate, hold=0.0)
+    queue = jobs.RenderQueue(db, quiet_window=getattr(env, 'refresh_quiet_window', 2.0),
+                             max_delay=getattr(env, 'refresh_max_delay', 10.0))
+
+    # Only the HTTP API is used, channels are addressed through partial messageables
+    client = discord.Client(intents=discord.Intents.none())
+    await client.login(env.token)
+
+    async def render_guild(guild_id: int, force: bool):
+        # The bot process and other workers write the same rows, start every job from what is stored
+        rosters.invalidate(guild_id)
+        display_map.forget(guild_id)
+        guild_roster = await rosters.get(guild_id)
+        if guild_roster.display_channel_id is None:
+            return
+
+        channel = client.get_partial_messageable(guild_roster.display_channel_id, guild_id=guild_id,
+                                                 type=discord.ChannelType.text)
+        try:
+            await render.render(guild_id, channel, client.user, display.blocks(guild_roster, args.layout),
+                                display_map, rest, force=force)
+        except (discord.Forbidden, discord.NotFound) as e:
+            # The channel is gone or closed to the bot, retrying will not help until it is set up again
+            logger.warning(f'Cannot update display channel {channel.id} of guild {guild_id}: {e}')
+
+    if args.metrics_port:
+        await metrics.serve(getattr(env, 'metrics_host', '127.0.0.1'), args.metrics_port)
+
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    logger.info(f'Render worker {worker_id} started with {args.concurrency} slots')
+    try:
+        await jobs.RenderWorker(queue, render_guild, worker_id, concurrency=args.concurrency).run()
+    finally:
+        await client.close()
+        await db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render display channels from the queued render jobs')
+    parser.add_argument('--database', default='bot_data.db')
+    parser.add_argument('--concurrency', type=int, default=getattr(env, 'render_workers', 2),
+                        help='renders this process runs at the same time')
+    parser.add_argument('--layout', choices=['groups', 'compact'], default=getattr(env, 'display_layout', 'groups'))
+    parser.add_argument('--global-rate', type=int, default=getattr(env, 'render_worker_rate', 20),
+                        help="requests per second, this process's share of render_worker_rate")
+    parser.add_argument('--metrics-port', type=int, default=None)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass